@@ -0,0 +1,106 @@
+#! /opt/local/bin/python
+# analytics.py contains performance statistics for equity curves
+# every function takes one curve (a 1-d array) or many (a runs x days matrix, e.g. sweep.equity or simulator.equity)
+# and works along the last axis, so thousands of runs are measured without a python loop over them
+
+import numpy as np
+
+
+# trading days per year, for annualizing
+PERIODS = 252
+
+
+# step-to-step simple returns, one fewer than there are values
+def returns(equity):
+  equity = np.asarray(equity, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.diff(equity, axis=-1)/equity[..., :-1]
+
+
+# total return from the first value to the last
+def total_return(equity):
+  equity = np.asarray(equity, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return equity[..., -1]/equity[..., 0] - 1
+
+
+# drawdown after every step, as a fraction below the highest value so far
+def drawdowns(equity):
+  equity = np.asarray(equity, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return 1 - equity/np.maximum.accumulate(equity, axis=-1)
+
+
+# deepest drawdown
+def max_drawdown(equity):
+  return drawdowns(equity).max(axis=-1)
+
+
+# longest time (in steps) spent below an earlier high, including a drawdown still under way at the end
+def drawdown_duration(equity):
+  equity = np.asarray(equity, dtype=np.float64)
+  steps = np.arange(equity.shape[-1])
+  peaks = np.where(equity >= np.maximum.accumulate(equity, axis=-1), steps, 0)
+  return (steps - np.maximum.accumulate(peaks, axis=-1)).max(axis=-1)
+
+
+# annualized standard deviation of the returns
+def volatility(equity, periods=PERIODS):
+  return returns(equity).std(axis=-1)*np.sqrt(periods)
+
+
+# annualized Sharpe ratio, rate is the annual risk-free rate; NaN for curves that never move
+def sharpe(equity, rate=0.0, periods=PERIODS):
+  excess = returns(equity) - rate/periods
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.where(excess.std(axis=-1) > 0, excess.mean(axis=-1)/excess.std(axis=-1), np.nan)*np.sqrt(periods)
+
+
+# annualized Sortino ratio, like sharpe but only counting the downside of the returns as risk
+def sortino(equity, rate=0.0, periods=PERIODS):
+  excess = returns(equity) - rate/periods
+  downside = np.sqrt((np.minimum(excess, 0)**2).mean(axis=-1))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.where(downside > 0, excess.mean(axis=-1)/downside, np.nan)*np.sqrt(periods)
+
+
+# annualized turnover: value traded per year as a multiple of the average equity
+# traded has the same shape as equity, e.g. portfolio.series('traded')
+def turnover(traded, equity, periods=PERIODS):
+  traded = np.asarray(traded, dtype=np.float64)
+  equity = np.asarray(equity, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return traded.sum(axis=-1)/equity.mean(axis=-1)*periods/traded.shape[-1]
+
+
+# profit and loss per ticker of a portfolio: cash flows from its trades plus the value of the shares still held
+# the values add up to the portfolio's change in value since it started
+def pnl(portfolio):
+  result = dict(portfolio.flows)
+  for ticker, shares in portfolio.shares.items():
+    if shares:
+      result[ticker] = result.get(ticker, 0.0) + shares*portfolio.curprices[ticker]
+  return result
+
+
+# P&L per ticker for many portfolios as a matrix, portfolios x tickers, with the sorted tickers
+def pnl_matrix(portfolios):
+  rows = [pnl(p) for p in portfolios]
+  tickers = sorted(set(t for row in rows for t in row))
+  index = dict((t, j) for j, t in enumerate(tickers))
+  m = np.zeros((len(rows), len(tickers)))
+  for i, row in enumerate(rows):
+    for t, v in row.items():
+      m[i, index[t]] = v
+  return m, tickers
+
+
+# every statistic at once, as a dictionary of arrays (or numbers for a single curve)
+# traded adds the turnover, e.g. summary(p.series('equity'), p.series('traded'))
+def summary(equity, traded=None, rate=0.0, periods=PERIODS):
+  stats = {'total return': total_return(equity), 'volatility': volatility(equity, periods),
+           'sharpe': sharpe(equity, rate, periods), 'sortino': sortino(equity, rate, periods),
+           'max drawdown': max_drawdown(equity), 'drawdown duration': drawdown_duration(equity)}
+  if traded is not None:
+    stats['turnover'] = turnover(traded, equity, periods)
+  return stats
@@ -0,0 +1,234 @@
+#! /opt/local/bin/python
+# backtest.py contains the universe object (aligned price matrices) and the vectorized backtest engine
+
+import numpy as np
+from datetime import date
+from stock import StockError, cache
+
+
+# orders are evaluated in chunks so the (days x orders) trigger matrices stay within this many cells
+CHUNK_CELLS = 1 << 22
+
+
+# price matrices for a set of tickers
+class universe:
+  'Open/high/low/close/volume matrices for many tickers aligned on one shared trading-day axis'
+
+  # load each ticker with the columnar backend and align them on the union of their trading days
+  # start and end (datetime.date objects) optionally clip the axis
+  # tickers that fail to load are recorded in errors instead of aborting the whole universe
+  # each ticker's columns are copied out as it is loaded, so its datfile map is released once the cache evicts it
+  def __init__(self, tickers, start=False, end=False, adjusted=True):
+    self.tickers = []
+    self.errors = dict()
+    series = [] # (date ordinals, [opens, highs, lows, closes, volumes]) per ticker, oldest first
+    for t in tickers:
+      try:
+        s = cache.get(t)
+        first, last = s.earliest_date(), s.latest_date()
+        series.append((s.columns['Date'][::-1].copy(),
+                       [np.array(f(first, last, adjusted)[::-1]) for f in [s.opens, s.highs, s.lows, s.closes, s.volumes]]))
+      except StockError as e:
+        self.errors[t] = e.value
+        continue
+      except EnvironmentError as e: # an unreadable datfile, or mapping it failed (e.g. out of file descriptors)
+        self.errors[t] = 'Error: Could not load ' + t + ' (' + str(e) + ').'
+        continue
+      self.tickers.append(t)
+    self.index = dict((t, i) for i, t in enumerate(self.tickers))
+
+    # trading-day axis, oldest first, as date ordinals
+    if series:
+      days = np.unique(np.concatenate([sdays for sdays, values in series]))
+    else:
+      days = np.zeros(0, dtype=np.int64)
+    if start:
+      days = days[days >= start.toordinal()]
+    if end:
+      days = days[days <= end.toordinal()]
+    self.days = days
+
+    # price matrices are days x tickers, NaN where a ticker has no bar
+    shape = (len(self.days), len(self.tickers))
+    self.opens = np.full(shape, np.nan)
+    self.highs = np.full(shape, np.nan)
+    self.lows = np.full(shape, np.nan)
+    self.closes = np.full(shape, np.nan)
+    self.volumes = np.full(shape, np.nan)
+    for j, (sdays, values) in enumerate(series):
+      keep = np.in1d(sdays, self.days)
+      if not keep.any():
+        continue
+      rows = np.searchsorted(self.days, sdays[keep])
+      for matrix, column in zip([self.opens, self.highs, self.lows, self.closes, self.volumes], values):
+        matrix[rows, j] = column[keep]
+
+
+  # string is number of tickers and days
+  def __str__(self):
+    return repr('universe of %d tickers over %d days' % (len(self.tickers), len(self.days)))
+
+
+  # trading days as datetime.date objects
+  def dates(self):
+    return [date.fromordinal(d) for d in self.days.tolist()]
+
+
+  # closing prices carried forward over days without a bar, for marking positions to market
+  def filled_closes(self):
+    closes = self.closes.copy()
+    rows = np.where(np.isnan(closes), 0, np.arange(len(self.days))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return closes[rows, np.arange(len(self.tickers))[None, :]]
+
+
+
+
+
+
+
+
+# vectorized backtest over a universe
+class backtest:
+  'Runs a list of orders against a universe with the same fill rules as portfolio, all orders and days at once'
+
+  # initialize with a universe, starting money and commission rate, like portfolio
+  def __init__(self, universe, money=0, commission=10):
+    self.universe = universe
+    self.money = money
+    self.commission = commission
+
+    # orders are stored column-wise: day placed (ordinal), side (+1 buy, -1 sell), ticker column, shares, limit, stop, exp (ordinal)
+    # missing limit, stop and exp are stored as NaN, NaN and 0
+    self.order_days = []
+    self.order_sides = []
+    self.order_cols = []
+    self.order_shares = []
+    self.order_limits = []
+    self.order_stops = []
+    self.order_exps = []
+
+
+  # queue an order placed on day, where stock is a stock object or ticker
+  def __order(self, day, side, stock, shares, limit, stop, exp):
+    if exp and exp <= day:
+      raise StockError('Error: Order expiration date must be after current date.')
+    ticker = getattr(stock, 'ticker', stock)
+    if ticker not in self.universe.index:
+      raise StockError('Error: Ticker symbol ' + ticker + ' is not in this universe.')
+    self.order_days.append(day.toordinal())
+    self.order_sides.append(side)
+    self.order_cols.append(self.universe.index[ticker])
+    self.order_shares.append(shares)
+    self.order_limits.append(limit if limit else np.nan)
+    self.order_stops.append(stop if stop else np.nan)
+    self.order_exps.append(exp.toordinal() if exp else 0)
+
+
+  # puts in a buy order on day, with the same limit/stop/exp semantics as portfolio.buy
+  def buy(self, day, stock, shares, limit=False, stop=False, exp=False):
+    if stop and limit and stop < limit:
+      print 'Warning: Buy order has stop price less than limit price. This becomes a market order.'
+      limit = False
+      stop = False
+    self.__order(day, 1, stock, shares, limit, stop, exp)
+
+
+  # puts in a sell order on day, with the same limit/stop/exp semantics as portfolio.sell
+  # unlike portfolio.sell, shares must be given explicitly since holdings are only known after run()
+  def sell(self, day, stock, shares, limit=False, stop=False, exp=False):
+    if shares <= 0:
+      raise StockError('Error: Vectorized sell orders need an explicit share count.')
+    if stop and limit and stop > limit:
+      print 'Warning: Sell order has stop price greater than limit price. This becomes a market order.'
+      limit = False
+      stop = False
+    self.__order(day, -1, stock, shares, limit, stop, exp)
+
+
+  # find the fill day and price of every order
+  # an order placed on day d is live from the next session after d until the session before exp
+  # returns arrays of fill row (-1 if never filled) and fill price
+  def __fills(self):
+    u = self.universe
+    n = len(self.order_days)
+    fill_rows = np.full(n, -1, dtype=np.int64)
+    fill_prices = np.full(n, np.nan)
+    if n == 0 or len(u.days) == 0:
+      return fill_rows, fill_prices
+    days = np.arange(len(u.days))[:, None]
+    starts = np.searchsorted(u.days, np.array(self.order_days), 'right')
+    exps = np.array(self.order_exps)
+    ends = np.where(exps > 0, np.searchsorted(u.days, exps, 'left'), len(u.days))
+    sides = np.array(self.order_sides)
+    cols = np.array(self.order_cols)
+    limits = np.array(self.order_limits, dtype=np.float64)
+    stops = np.array(self.order_stops, dtype=np.float64)
+    chunk = max(1, CHUNK_CELLS // len(u.days))
+    for lo in range(0, n, chunk):
+      hi = min(n, lo + chunk)
+      c = cols[lo:hi]
+      O, H, L = u.opens[:, c], u.highs[:, c], u.lows[:, c]
+      lim, stp, buy = limits[None, lo:hi], stops[None, lo:hi], sides[None, lo:hi] > 0
+      has_lim, has_stp = ~np.isnan(lim), ~np.isnan(stp)
+      with np.errstate(invalid='ignore'):
+        # buys: limit fills at open below the limit or intraday low touching it, stop at open above or intraday high
+        # sells mirror this: limit at open above or intraday high, stop at open below or intraday low
+        lim_open = has_lim & np.where(buy, O < lim, O > lim)
+        lim_day = has_lim & np.where(buy, L <= lim, H >= lim)
+        stp_open = has_stp & np.where(buy, O > stp, O < stp)
+        stp_day = has_stp & np.where(buy, H >= stp, L <= stp)
+      market = ~has_lim & ~has_stp
+      live = (days >= starts[None, lo:hi]) & (days < ends[None, lo:hi]) & ~np.isnan(O)
+      hit = live & (lim_open | lim_day | stp_open | stp_day | market)
+      price = np.where(lim_open, O, np.where(lim_day, lim, np.where(stp_open, O, np.where(stp_day, stp, O))))
+      first = hit.argmax(axis=0)
+      k = np.arange(hi - lo)
+      filled = hit[first, k]
+      fill_rows[lo:hi] = np.where(filled, first, -1)
+      fill_prices[lo:hi] = np.where(filled, price[first, k], np.nan)
+    return fill_rows, fill_prices
+
+
+  # execute every queued order and build the fills, positions, cash and equity series
+  # cash follows portfolio.__ibuy/__isell exactly, including how commission is applied
+  # days without a bar for a ticker never trigger its orders, and positions are marked at the last known close
+  def run(self):
+    u = self.universe
+    fill_rows, fill_prices = self.__fills()
+    filled = np.nonzero(fill_rows >= 0)[0]
+    filled = filled[np.lexsort((filled, fill_rows[filled]))]
+    sides = np.array(self.order_sides, dtype=np.int64)[filled]
+    shares = np.array(self.order_shares, dtype=np.int64)[filled]
+    cols = np.array(self.order_cols, dtype=np.int64)[filled]
+    rows = fill_rows[filled]
+    prices = fill_prices[filled]
+
+    # one record per executed order, in execution order
+    self.fills = np.zeros(len(filled), dtype=[('order', np.int64), ('date', np.int64), ('ticker', np.int64),
+                                              ('side', np.int64), ('shares', np.int64), ('price', np.float64)])
+    self.fills['order'] = filled
+    self.fills['date'] = u.days[rows]
+    self.fills['ticker'] = cols
+    self.fills['side'] = sides
+    self.fills['shares'] = shares
+    self.fills['price'] = prices
+
+    # positions (days x tickers), cash and equity (days)
+    deltas = np.zeros((len(u.days), len(u.tickers)), dtype=np.int64)
+    np.add.at(deltas, (rows, cols), sides*shares)
+    self.positions = np.cumsum(deltas, axis=0)
+    flows = np.zeros(len(u.days))
+    np.add.at(flows, rows, -sides*(prices*shares - self.commission))
+    self.cash = self.money + np.cumsum(flows)
+    marks = np.nan_to_num(u.filled_closes())
+    self.equity = self.cash + (self.positions*marks).sum(axis=1)
+    return self.equity
+
+
+  # final holdings as a dictionary of ticker -> shares, like portfolio.shares
+  def shares(self):
+    if not len(self.universe.days):
+      return dict()
+    last = self.positions[-1]
+    return dict((self.universe.tickers[j], int(last[j])) for j in np.nonzero(last)[0])
@@ -0,0 +1,438 @@
+#! /opt/local/bin/python
+# bench.py times the stock and portfolio hot paths on synthetic data in a temporary directory, no network needed
+#   python bench.py [--quick] [--out results.json] [--baseline previous.json]
+#   python bench.py --check     checks that the order execution paths agree, exits with status 1 if they don't
+# each case runs in its own process so its peak memory can be reported, and results are written as JSON to diff between versions
+
+import matplotlib
+matplotlib.use('Agg')
+import sys, os, time, json, random, shutil, tempfile, resource, argparse, platform, itertools, subprocess
+import multiprocessing
+import cPickle as pickle
+from datetime import date, timedelta
+import numpy as np
+import matplotlib.pyplot as plt
+from stock import stock, portfolio, write_columns, columns_from_rows
+from backtest import universe, backtest
+from simulator import simulator
+from feed import feed, replay_stocks
+
+
+# first synthetic trading day
+START = date(1960, 1, 4)
+
+# datfile layouts benchmarked: row backend on pickles, columnar backend on pickles, columnar backend on memory-mapped binary files
+BACKENDS = ['rows', 'columnar', 'mmap']
+
+# history lengths (trading days) for the scaling curves, and (positions, resting orders) for portfolio.step
+SIZES = [1000, 4000, 16000]
+QUICK_SIZES = [1000, 4000]
+STEP_SIZES = [(10, 100), (100, 1000), (100, 10000)]
+QUICK_STEP_SIZES = [(10, 100), (100, 1000)]
+
+# tickers in the portfolio universe and their history length
+UNIVERSE = 100
+UNIVERSE_DAYS = 1000
+
+# --check trades this many universe tickers for this many days, placing this many random orders a day
+CHECK_TICKERS = 20
+CHECK_DAYS = 400
+CHECK_ORDERS = 4
+
+# relative equity difference allowed between the step-by-step portfolio and the vectorized backtest,
+# which sum the same cash flows in a different order
+CHECK_TOLERANCE = 1e-9
+
+
+
+
+
+
+
+
+# synthetic yahoo-style rows for one ticker, newest first, with occasional splits in Adj Close
+def synthetic_rows(days, seed):
+  rnd = random.Random(seed)
+  rows = []
+  day = START
+  price = 50.0
+  factor = 1.0
+  while len(rows) < days:
+    if day.weekday() < 5:
+      o = price*(1 + rnd.gauss(0, 0.01))
+      c = o*(1 + rnd.gauss(0, 0.02))
+      h = max(o, c)*(1 + abs(rnd.gauss(0, 0.01)))
+      l = min(o, c)*(1 - abs(rnd.gauss(0, 0.01)))
+      if rnd.random() < 0.001:
+        factor *= 0.5
+      rows.append({'Date': day, 'Open': '%0.2f' % o, 'High': '%0.2f' % h, 'Low': '%0.2f' % l, 'Close': '%0.2f' % c,
+                   'Volume': str(rnd.randint(1000, 1000000)), 'Adj Close': '%0.2f' % (c*factor)})
+      price = c
+    day += timedelta(days=1)
+  rows.reverse()
+  return rows
+
+
+# write the synthetic datfiles for every backend under root, returns {backend: directory to run in}
+def generate(root, sizes):
+  dirs = dict()
+  tickers = [('H%d' % n, n) for n in sizes] + [('U%03d' % i, UNIVERSE_DAYS) for i in range(UNIVERSE)] + [('AAPL', UNIVERSE_DAYS)]
+  for i, (ticker, days) in enumerate(tickers):
+    rows = synthetic_rows(days, i)
+    for backend in BACKENDS:
+      datadir = os.path.join(root, backend, 'data')
+      if not os.path.isdir(datadir):
+        os.makedirs(datadir)
+      datfile = os.path.join(datadir, ticker + '.dat')
+      if backend == 'mmap':
+        write_columns(datfile, columns_from_rows(rows))
+      else:
+        pickle.dump(rows, open(datfile, 'wb'), -1)
+  for backend in BACKENDS:
+    dirs[backend] = os.path.join(root, backend)
+  return dirs
+
+
+# calls per second of op, best of repeat runs of at least min_time seconds each
+def measure(op, min_time, repeat=3):
+  best = 0.0
+  for r in range(repeat):
+    calls = 0
+    start = time.time()
+    elapsed = 0.0
+    while elapsed < min_time:
+      op()
+      calls += 1
+      elapsed = time.time() - start
+    best = max(best, calls/elapsed)
+  return best
+
+
+
+
+
+
+
+
+# the benchmark cases, each returns an op to time given the backend and size
+def case_load(backend, size):
+  ticker = 'H%d' % size
+  return lambda: stock(ticker, columnar=backend != 'rows')
+
+
+def _lookups(backend, size, method):
+  s = stock('H%d' % size, columnar=backend != 'rows')
+  days = s.days(s.earliest_date(), s.latest_date() - timedelta(days=1)) # every day has a next day
+  random.Random(0).shuffle(days)
+  it = itertools.cycle(days)
+  f = getattr(s, method)
+  return lambda: f(next(it))
+
+
+def case_close(backend, size):
+  return _lookups(backend, size, 'close')
+
+
+def case_high(backend, size):
+  return _lookups(backend, size, 'high')
+
+
+def case_set_date(backend, size):
+  return _lookups(backend, size, 'set_date')
+
+
+def case_next_day(backend, size):
+  return _lookups(backend, size, 'next_day')
+
+
+# one-year range queries at random starting points
+def _ranges(backend, size, method):
+  s = stock('H%d' % size, columnar=backend != 'rows')
+  days = s.days(s.earliest_date(), s.latest_date() - timedelta(days=366))
+  random.Random(0).shuffle(days)
+  it = itertools.cycle(days)
+  f = getattr(s, method)
+  def op():
+    start = next(it)
+    return f(start, start + timedelta(days=365))
+  return op
+
+
+def case_closes(backend, size):
+  return _ranges(backend, size, 'closes')
+
+
+def case_days(backend, size):
+  return _ranges(backend, size, 'days')
+
+
+# one year of OHLC bars rendered to an in-memory figure
+def case_plot_ohlc(backend, size):
+  s = stock('H%d' % size, columnar=backend != 'rows')
+  end = s.latest_date()
+  def op():
+    s.plot_ohlc(end - timedelta(days=365), end)
+    plt.close('all')
+  return op
+
+
+# portfolio.step with positions held and resting limit orders that never fill
+# size is (positions, orders); the portfolio is rebuilt whenever the history runs out
+def case_step(backend, size):
+  positions, orders = size
+  columnar = backend != 'rows'
+  stocks = [stock('U%03d' % i, columnar=columnar) for i in range(UNIVERSE)]
+  start = stocks[0].earliest_date()
+  state = dict()
+  def build():
+    p = portfolio(1e12, 0, start)
+    for s in stocks[:positions]:
+      p.buy(s, 100)
+    p.step()
+    for i in range(orders):
+      s = stocks[i % UNIVERSE]
+      p.buy(s, 1, limit=s.close(p.date)*0.01)
+    state['p'] = p
+    state['steps'] = UNIVERSE_DAYS - 3
+  build()
+  def op():
+    if not state['steps']:
+      build()
+    state['p'].step()
+    state['steps'] -= 1
+  return op
+
+
+CASES = [('load', case_load), ('close', case_close), ('high', case_high), ('set_date', case_set_date),
+         ('next_day', case_next_day), ('closes', case_closes), ('days', case_days), ('plot_ohlc', case_plot_ohlc),
+         ('step', case_step)]
+
+
+
+
+
+
+
+
+# strategy placing random market, limit, stop and stop limit orders, some with an expiry, on the tickers given
+# stocks are looked up with lookup(ticker), so the same orders can go to stocks or to feed quotes
+# sells never exceed the shares held less those already offered; every order is also queued on bt if given
+def random_strategy(tickers, lookup, seed, bt=False):
+  rnd = random.Random(seed)
+  def strategy(p):
+    for k in range(CHECK_ORDERS):
+      s = lookup(rnd.choice(tickers))
+      c = s.close(p.date)
+      kind = rnd.choice(['market', 'limit', 'stop', 'stop limit'])
+      exp = p.date + timedelta(days=rnd.randint(1, 10)) if rnd.random() < 0.5 else False
+      u = rnd.uniform(0, 0.03)
+      if rnd.random() < 0.6:
+        side, shares, limit, stop = 1, rnd.randint(1, 50), c*(1 - u), c*(1 + u)
+      else:
+        free = p.shares[s.ticker] - sum(o.shares for o in p.sell_orders.pending(s.ticker))
+        if free <= 0:
+          continue
+        side, shares, limit, stop = -1, rnd.randint(1, free), c*(1 + u), c*(1 - u)
+      limit = limit if 'limit' in kind else False
+      stop = stop if 'stop' in kind else False
+      (p.buy if side > 0 else p.sell)(s, shares, limit, stop, exp)
+      if bt:
+        (bt.buy if side > 0 else bt.sell)(p.date, s.ticker, shares, limit, stop, exp)
+  return strategy
+
+
+# step-by-step portfolio against the vectorized backtest fed the same orders: same fills, shares and equity
+def check_backtest(backend):
+  tickers = ['U%03d' % i for i in range(CHECK_TICKERS)]
+  stocks = dict((t, stock(t, columnar=backend != 'rows')) for t in tickers)
+  start = stocks[tickers[0]].earliest_date()
+  end = stocks[tickers[0]].calendar.date(CHECK_DAYS) # the last day stepped to, so no order fills after it
+  p = portfolio(1e6, 7, start)
+  bt = backtest(universe(tickers, start, end), 1e6, 7)
+  strategy = random_strategy(tickers, stocks.get, 0, bt)
+  for i in range(CHECK_DAYS):
+    strategy(p)
+    p.step()
+  equity = bt.run()[np.searchsorted(bt.universe.days, p.series('date'))]
+  diff = np.abs(equity - p.series('equity')).max()/np.abs(p.series('equity')).max()
+  errors = []
+  if len(bt.fills) != len(p.journal):
+    errors.append('%d fills, the backtest has %d' % (len(p.journal), len(bt.fills)))
+  if bt.shares() != dict((t, n) for t, n in p.shares.items() if n):
+    errors.append('final shares differ')
+  if not diff <= CHECK_TOLERANCE:
+    errors.append('equity differs by %0.3g' % diff)
+  return errors, '%d fills, equity within %0.3g' % (len(p.journal), diff)
+
+
+# portfolios stepped one at a time against the same portfolios stepped in lockstep by a simulator: identical
+def check_simulator(backend):
+  tickers = ['U%03d' % i for i in range(CHECK_TICKERS)]
+  stocks = dict((t, stock(t, columnar=backend != 'rows')) for t in tickers)
+  start = stocks[tickers[0]].earliest_date()
+  alone = []
+  for seed in range(4):
+    p = portfolio(1e6, 7, start)
+    strategy = random_strategy(tickers, stocks.get, seed)
+    for i in range(CHECK_DAYS):
+      strategy(p)
+      p.step()
+    alone.append(p)
+  sim = simulator([portfolio(1e6, 7, start) for seed in range(4)],
+                  [random_strategy(tickers, stocks.get, seed) for seed in range(4)])
+  sim.run(CHECK_DAYS)
+  errors = []
+  for seed, (a, b) in enumerate(zip(alone, sim.portfolios)):
+    if not (np.array_equal(a.series('equity'), b.series('equity')) and a.journal.rows() == b.journal.rows()):
+      errors.append('portfolio %d differs in lockstep' % seed)
+  return errors, '%d portfolios, %d fills' % (len(alone), sum(len(p.journal) for p in alone))
+
+
+# a portfolio stepped from stocks against the same portfolio run by a feed replaying their bars: identical
+def check_feed(backend):
+  tickers = ['U%03d' % i for i in range(CHECK_TICKERS)]
+  stocks = dict((t, stock(t, columnar=backend != 'rows')) for t in tickers)
+  start = stocks[tickers[0]].earliest_date()
+  a = portfolio(1e6, 7, start)
+  strategy = random_strategy(tickers, stocks.get, 0)
+  for i in range(CHECK_DAYS):
+    strategy(a)
+    a.step()
+  f = feed(replay_stocks(stocks.values(), start, a.date))
+  b = portfolio(1e6, 7, start)
+  f.run([b], [random_strategy(tickers, f.quote, 0)])
+  errors = []
+  if b.date != a.date or not np.array_equal(a.series('equity'), b.series('equity')) or a.journal.rows() != b.journal.rows():
+    errors.append('the feed run differs')
+  return errors, '%d fills' % len(a.journal)
+
+
+CHECKS = [('backtest', check_backtest), ('simulator', check_simulator), ('feed', check_feed)]
+
+
+
+
+
+
+
+
+# run one case in a child process so peak memory is its own
+def _child(queue, directory, name, backend, size, min_time):
+  try:
+    os.chdir(directory)
+    op = dict(CASES)[name](backend, size)
+    rate = measure(op, min_time)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+      peak /= 1024 # bytes on mac, kilobytes elsewhere
+    queue.put({'ops_per_sec': rate, 'peak_kb': peak})
+  except Exception as e:
+    queue.put({'error': e.__class__.__name__ + ': ' + str(e)})
+
+
+# run one check in a child process, so every backend starts with an empty stock cache
+def _check_child(queue, directory, name, backend):
+  try:
+    os.chdir(directory)
+    errors, summary = dict(CHECKS)[name](backend)
+    queue.put({'errors': errors, 'summary': summary})
+  except Exception as e:
+    queue.put({'errors': [e.__class__.__name__ + ': ' + str(e)], 'summary': ''})
+
+
+def run_case(directory, name, backend, size, min_time):
+  queue = multiprocessing.Queue()
+  child = multiprocessing.Process(target=_child, args=(queue, directory, name, backend, size, min_time))
+  child.start()
+  result = queue.get()
+  child.join()
+  return result
+
+
+# run every case for every backend and size, printing as it goes, returns the results document
+def run(quick=False, min_time=0.2, cases=False):
+  sizes = QUICK_SIZES if quick else SIZES
+  step_sizes = QUICK_STEP_SIZES if quick else STEP_SIZES
+  root = tempfile.mkdtemp(prefix='prysms-bench-')
+  try:
+    dirs = generate(root, sizes)
+    results = []
+    for name, f in CASES:
+      if cases and name not in cases:
+        continue
+      for backend in BACKENDS:
+        for size in (step_sizes if name == 'step' else sizes):
+          result = run_case(dirs[backend], name, backend, size, min_time)
+          result.update({'case': name, 'backend': backend, 'size': list(size) if isinstance(size, tuple) else size})
+          results.append(result)
+          print format_result(result)
+          sys.stdout.flush()
+  finally:
+    shutil.rmtree(root)
+  try:
+    version = subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    version = 'unknown'
+  return {'version': version, 'python': platform.python_version(), 'machine': platform.machine(),
+          'date': date.today().isoformat(), 'quick': quick, 'results': results}
+
+
+# run every check for every backend on the quick synthetic data, printing as it goes
+# returns the number of checks that failed
+def check():
+  root = tempfile.mkdtemp(prefix='prysms-check-')
+  failed = 0
+  try:
+    dirs = generate(root, QUICK_SIZES)
+    for name, f in CHECKS:
+      for backend in BACKENDS:
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_check_child, args=(queue, dirs[backend], name, backend))
+        child.start()
+        result = queue.get()
+        child.join()
+        failed += bool(result['errors'])
+        print '%-10s %-9s %-5s %s' % (name, backend, 'FAIL' if result['errors'] else 'ok', '; '.join(result['errors']) or result['summary'])
+        sys.stdout.flush()
+  finally:
+    shutil.rmtree(root)
+  return failed
+
+
+# one line per result
+def format_result(result, baseline=False):
+  line = '%-10s %-9s %-12s' % (result['case'], result['backend'], result['size'])
+  if 'error' in result:
+    return line + ' error: ' + result['error']
+  line += ' %14.1f ops/s %10d KB' % (result['ops_per_sec'], result['peak_kb'])
+  if baseline and 'ops_per_sec' in baseline:
+    ratio = result['ops_per_sec']/baseline['ops_per_sec']
+    line += '   %5.2fx%s' % (ratio, '  REGRESSION' if ratio < 0.8 else '')
+  return line
+
+
+# print results next to a baseline document, matching on case, backend and size
+def compare(results, baseline):
+  key = lambda r: (r['case'], r['backend'], json.dumps(r['size']))
+  old = dict((key(r), r) for r in baseline['results'])
+  print 'compared with %s (%s)' % (baseline.get('version'), baseline.get('date'))
+  for r in results['results']:
+    print format_result(r, old.get(key(r), False))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the stock and portfolio hot paths.')
+  parser.add_argument('--quick', action='store_true', help='smaller sizes, for a fast check')
+  parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing run')
+  parser.add_argument('--case', action='append', help='only run this case (can be repeated)')
+  parser.add_argument('--out', help='write results to this JSON file')
+  parser.add_argument('--baseline', help='compare with results from an earlier run')
+  parser.add_argument('--check', action='store_true', help='check the order execution paths against each other instead')
+  args = parser.parse_args()
+  if args.check:
+    sys.exit(1 if check() else 0)
+  results = run(args.quick, args.min_time, args.case)
+  if args.out:
+    json.dump(results, open(args.out, 'w'), indent=2, sort_keys=True)
+  if args.baseline:
+    compare(results, json.load(open(args.baseline)))
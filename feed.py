@@ -0,0 +1,375 @@
+#! /opt/local/bin/python
+# feed.py contains the feed object, which steps portfolios through daily bars as they stream in
+#   f = feed(merge_csv(glob.glob('csv/*.csv')))          # or replay('bars.csv'), connect(address), replay_stocks(...)
+#   p = portfolio(100000, 7, date(2010, 1, 4), calendar=weekday_calendar(date(2010, 1, 4), date(2030, 1, 1)))
+#   f.run([p], [lambda p: strategy(p, f.quote)])          # strategy(p) after every day's bars, like simulator.run
+# bars are (date, ticker, open, high, low, close, volume) tuples in date order; each day's bars are collected
+# into one dictionary and handed to portfolio.step, which executes orders exactly as it does from stocks
+# only the last window bars of each ticker are kept (see quote), so memory is bounded however long or wide the stream is
+
+import os, time, socket, threading, heapq, bisect
+from collections import deque
+from datetime import date
+from stock import StockError, union_calendar
+
+
+# header of bar files and streams, one bar per line after it
+BAR_HEADER = 'Date,Ticker,Open,High,Low,Close,Volume'
+
+# where publish serves and connect reads a bar stream by default
+ADDRESS = ('127.0.0.1', 8766)
+
+
+# bar as a line of text
+def format_bar(bar):
+  return '%s,%s,%r,%r,%r,%r,%d' % bar
+
+
+# bar from a line of text
+def parse_bar(line):
+  fields = line.rstrip('\r\n').split(',')
+  if len(fields) != 7:
+    raise StockError('Error: Malformed bar ' + repr(line) + '.')
+  y, m, d = fields[0].split('-')
+  return (date(int(y), int(m), int(d)), fields[1], float(fields[2]), float(fields[3]), float(fields[4]),
+          float(fields[5]), int(fields[6]))
+
+
+
+
+
+
+
+
+# bars of a bar file, read one line at a time
+def replay(filename):
+  for line in open(filename):
+    if line.strip() and not line.startswith('Date,'):
+      yield parse_bar(line)
+
+
+# write a stream of bars to a bar file, e.g. to record a feed for replay
+def write_bars(filename, bars):
+  f = open(filename, 'w')
+  f.write(BAR_HEADER + '\n')
+  for bar in bars:
+    f.write(format_bar(bar) + '\n')
+  f.close()
+
+
+# lines of a file from the last to the first, read block by block from the end
+def _lines_backward(f, block=1 << 16):
+  f.seek(0, os.SEEK_END)
+  pos = f.tell()
+  rest = ''
+  while pos > 0:
+    size = min(block, pos)
+    pos -= size
+    f.seek(pos)
+    lines = (f.read(size) + rest).split('\n')
+    rest = lines[0]
+    for line in reversed(lines[1:]):
+      yield line
+  yield rest
+
+
+# bars of one yahoo csv file, oldest first whichever order the file is in, dropping repeated dates
+# adjusted prices are scaled by Adj Close/Close and volume by its inverse, like stock.bar and stock.volume
+def _csv_bars(csvfile, ticker, adjusted):
+  f = open(csvfile, 'rb')
+  header = f.readline().strip().split(',')
+  for name in ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']:
+    if name not in header:
+      raise StockError('Error: ' + csvfile + ' has no ' + name + ' column.')
+  cols = [header.index(name) for name in ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']]
+  body = f.tell()
+  first = f.readline()
+  last = next((line for line in _lines_backward(f) if line.strip()), '')
+  if first.split(',')[0] > last.split(',')[0]: # newest first, as downloaded
+    lines = (line for line in _lines_backward(f) if line.strip() and not line.startswith('Date'))
+  else:
+    f.seek(body)
+    lines = (line for line in f if line.strip())
+  previous = ''
+  for line in lines:
+    fields = line.rstrip('\r\n').split(',')
+    day, o, h, l, c, a, v = [fields[i] for i in cols]
+    if day <= previous:
+      continue
+    previous = day
+    y, m, d = day.split('-')
+    o, h, l, c, a, v = float(o), float(h), float(l), float(c), float(a), float(v)
+    if adjusted:
+      factor = a/c
+      o, h, l, c, v = factor*o, factor*h, factor*l, a, round(c/a*v)
+    yield (date(int(y), int(m), int(d)), ticker, o, h, l, c, int(v))
+  f.close()
+
+
+# bars of many per-ticker yahoo csv files (named TICKER.csv) merged into one stream in date order
+# every file is read lazily, so only one bar per file is held at a time
+def merge_csv(csvfiles, adjusted=True):
+  return heapq.merge(*[_csv_bars(csvfile, os.path.splitext(os.path.basename(csvfile))[0], adjusted)
+                       for csvfile in csvfiles])
+
+
+# bars of loaded stocks between two days (inclusive), in date order, e.g. to check a feed against step()
+def replay_stocks(stocks, start, end, adjusted=True):
+  for day in union_calendar(stocks).sessions(start, end):
+    for s in stocks:
+      if s.calendar.is_session(day):
+        yield (day, s.ticker) + tuple(s.bar(day, adjusted)) + (s.volume(day, adjusted),)
+
+
+
+
+
+
+
+
+# serve a stream of bars to the first client that connects, on a background thread, as a local stand-in for a live feed
+# delay is the number of seconds to wait between days; returns the thread
+def publish(bars, address=ADDRESS, delay=0):
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  listener.bind(address)
+  listener.listen(1)
+  def run():
+    conn = listener.accept()[0]
+    listener.close()
+    try:
+      conn.sendall(BAR_HEADER + '\n')
+      day = None
+      for bar in bars:
+        if delay and day and bar[0] != day:
+          time.sleep(delay)
+        day = bar[0]
+        conn.sendall(format_bar(bar) + '\n')
+    except socket.error:
+      pass # the client went away
+    finally:
+      conn.close()
+  t = threading.Thread(target=run)
+  t.daemon = True
+  t.start()
+  return t
+
+
+# bars read from a stream served by publish (or anything speaking its protocol), until it closes
+def connect(address=ADDRESS, timeout=None):
+  conn = socket.create_connection(address, timeout)
+  try:
+    for line in conn.makefile('rb'):
+      if line.strip() and not line.startswith('Date,'):
+        yield parse_bar(line)
+  finally:
+    conn.close()
+
+
+
+
+
+
+
+
+# recent bars of one ticker from a feed
+class quote:
+  'Stock stand-in over the last bars of a ticker, with the same per-day and range accessors'
+
+  # bars are kept as they were streamed, so the adjusted arguments of the accessors are accepted and ignored
+  def __init__(self, ticker, window=256):
+    self.ticker = ticker
+    self.ordinals = deque(maxlen=window) # dates, oldest first
+    self.bars = deque(maxlen=window) # [open, high, low, close, volume], oldest first
+
+
+  def __str__(self):
+    return repr(self.ticker + ' (%d bars)' % len(self.ordinals))
+
+
+  # share the bars of another quote of the same ticker, so both see every bar added to either
+  def join(self, other):
+    self.ordinals = other.ordinals
+    self.bars = other.bars
+
+
+  # add the bar of a day after the last one
+  def add(self, day, o, h, l, c, v):
+    self.ordinals.append(day.toordinal())
+    self.bars.append([o, h, l, c, v])
+
+
+  # position of a day among the kept bars, the latest one being the usual case
+  def __idx(self, day):
+    key = day.toordinal()
+    if self.ordinals and self.ordinals[-1] == key:
+      return len(self.ordinals) - 1
+    i = bisect.bisect_left(self.ordinals, key)
+    if i == len(self.ordinals) or self.ordinals[i] != key:
+      raise StockError('Error: No data found for date ' + str(day) + ' for stock ' + self.ticker)
+    return i
+
+
+  # positions of the kept bars between two days (inclusive), newest first like the stock range accessors
+  def __span(self, start, end):
+    lo = bisect.bisect_left(self.ordinals, start.toordinal())
+    hi = bisect.bisect_right(self.ordinals, end.toordinal())
+    if lo >= hi:
+      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    return range(hi - 1, lo - 1, -1)
+
+
+  def latest_date(self):
+    return date.fromordinal(self.ordinals[-1])
+
+
+  def earliest_date(self):
+    return date.fromordinal(self.ordinals[0])
+
+
+  def bar(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][:4]
+
+
+  def open(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][0]
+
+
+  def high(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][1]
+
+
+  def low(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][2]
+
+
+  def close(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][3]
+
+
+  def volume(self, day, adjusted=True):
+    return self.bars[self.__idx(day)][4]
+
+
+  def opens(self, start, end, adjusted=True):
+    return [self.bars[i][0] for i in self.__span(start, end)]
+
+
+  def highs(self, start, end, adjusted=True):
+    return [self.bars[i][1] for i in self.__span(start, end)]
+
+
+  def lows(self, start, end, adjusted=True):
+    return [self.bars[i][2] for i in self.__span(start, end)]
+
+
+  def closes(self, start, end, adjusted=True):
+    return [self.bars[i][3] for i in self.__span(start, end)]
+
+
+  def volumes(self, start, end, adjusted=True):
+    return [self.bars[i][4] for i in self.__span(start, end)]
+
+
+  def average_volume(self, start, end, adjusted=True):
+    volumes = self.volumes(start, end)
+    return sum(volumes)/len(volumes)
+
+
+  def days(self, start, end):
+    return [date.fromordinal(self.ordinals[i]) for i in self.__span(start, end)]
+
+
+
+
+
+
+
+
+# streaming driver for a set of portfolios
+class feed:
+  'Groups a date-ordered stream of bars into days, keeping a bounded window of quotes per ticker'
+
+  # bars is any iterable of (date, ticker, open, high, low, close, volume) tuples in date order
+  # window is the number of recent bars kept per ticker for the quotes
+  def __init__(self, bars, window=256):
+    self.stream = iter(bars)
+    self.window = window
+    self.date = False     # the latest day read
+    self.bars = dict()    # [open, high, low, close] by ticker for the latest day, as portfolio.step takes them
+    self.quotes = dict()  # ticker -> quote
+    self.__next = None    # first bar of the next day, read ahead
+
+
+  # string is the number of tickers and the latest day
+  def __str__(self):
+    return repr('feed of %d tickers on %s' % (len(self.quotes), self.date))
+
+
+  # quote of a ticker, to place orders with and read recent prices from, like cache.get for stocks
+  def quote(self, ticker):
+    q = self.quotes.get(ticker)
+    if q is None:
+      q = self.quotes[ticker] = quote(ticker, self.window)
+    return q
+
+
+  # reconnect the quotes of a resumed or forked portfolio (see portfolio.checkpoint) to this feed
+  # a quote of a ticker the feed has not seen yet becomes the feed's quote, keeping its bars,
+  # otherwise it is joined to the feed's quote; either way it is updated by the feed from then on
+  def attach(self, p):
+    for q in [h.stock for h in p.holdings.values()] + [o.stock for o in p.buy_orders] + [o.stock for o in p.sell_orders]:
+      if isinstance(q, quote):
+        mine = self.quotes.setdefault(q.ticker, q)
+        if mine is not q:
+          q.join(mine)
+
+
+  # read the next day's bars, returns the day or False at the end of the stream
+  def next_day(self):
+    bar = self.__next or next(self.stream, None)
+    if bar is None:
+      return False
+    day = bar[0]
+    if self.date and day <= self.date:
+      raise StockError('Error: Bars for ' + str(day) + ' arrived after ' + str(self.date) + '.')
+    bars = dict()
+    while bar is not None and bar[0] == day:
+      if bar[1] in bars:
+        raise StockError('Error: Two bars for ' + bar[1] + ' on ' + str(day) + '.')
+      bars[bar[1]] = list(bar[2:6])
+      self.quote(bar[1]).add(*bar[:1] + bar[2:])
+      bar = next(self.stream, None)
+    self.__next = bar
+    self.date = day
+    self.bars = bars
+    return day
+
+
+  # iterate over the days of the stream, as (day, bars)
+  def __iter__(self):
+    while self.next_day():
+      yield self.date, self.bars
+
+
+  # step the portfolios through the stream, for at most days days if given; returns the number of days read
+  # a day after a portfolio's date steps it with the day's bars, then its strategy is called as strategy(p)
+  # so orders it places execute on the next day; days up to a portfolio's start only fill the quotes,
+  # and on its start day it is not stepped, so a portfolio starting on the first day behaves as one stepped from stocks
+  # portfolios resumed from a checkpoint are attached first, so the quotes they trade keep receiving bars; the strategy
+  # runs again on a resumed portfolio's date, so checkpoint from the strategy before it places that day's orders
+  def run(self, portfolios, strategies=[], days=False):
+    if strategies and len(strategies) != len(portfolios):
+      raise StockError('Error: A feed needs one strategy per portfolio.')
+    for p in portfolios:
+      self.attach(p)
+    n = 0
+    while (not days or n < days) and self.next_day():
+      n += 1
+      for p in portfolios:
+        if self.date > p.date:
+          p.step(self.bars, self.date)
+      for p, strategy in zip(portfolios, strategies):
+        if p.date == self.date:
+          strategy(p)
+    return n
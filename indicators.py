@@ -0,0 +1,400 @@
+#! /opt/local/bin/python
+# indicators.py contains rolling indicators (SMA, EMA, rolling min/max/std, ATR, RSI) for stock data
+# every indicator can be computed in batch over a whole column or updated one day at a time
+
+import math
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from datetime import timedelta
+from stock import StockError
+
+
+# stock range and scalar methods for each field an indicator can read
+RANGE_METHODS = {'Open': 'opens', 'High': 'highs', 'Low': 'lows', 'Close': 'closes', 'Volume': 'volumes'}
+SCALAR_METHODS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'}
+
+# batch results by (ticker, indicator, window, fields, adjusted, earliest date, latest date), see series()
+_series = dict()
+
+
+# sliding windows over a column as a (len-window+1, window) view, copying nothing
+def _windows(x, window):
+  return as_strided(x, shape=(len(x) - window + 1, window), strides=(x.strides[0], x.strides[0]))
+
+
+# y[i] = (1-alpha)*y[i-1] + alpha*x[i] starting from y[-1] = prev, without a python loop
+# uses the closed form in blocks short enough that the powers of (1-alpha) stay far from underflow
+def _recurse(x, alpha, prev):
+  if alpha >= 1 or not len(x):
+    return np.array(x, dtype=np.float64)
+  y = np.empty(len(x))
+  block = max(1, min(len(x), int(-200/math.log10(1 - alpha))))
+  p = (1 - alpha)**np.arange(block + 1)
+  for lo in range(0, len(x), block):
+    xb = x[lo:lo+block]
+    k = len(xb)
+    y[lo:lo+k] = p[1:k+1]*prev + alpha*p[:k]*np.cumsum(xb/p[:k])
+    prev = y[lo+k-1]
+  return y
+
+
+
+
+
+
+
+
+# base class for all indicators
+class indicator:
+  'Rolling indicator over one or more stock fields, NaN until window days have been seen'
+
+  fields = ['Close']
+
+  # field picks the stock column for single-column indicators, e.g. rolling_max(50, 'Close')
+  def __init__(self, window, field=False):
+    if window < 1:
+      raise StockError('Error: Indicator window must be at least one day.')
+    self.window = window
+    if field:
+      self.fields = [field]
+    self.reset()
+
+
+  # string is the indicator name and window
+  def __str__(self):
+    return repr('%s(%d)' % (self.__class__.__name__, self.window))
+
+
+  # forget everything seen so far
+  def reset(self):
+    self.value = np.nan
+
+
+
+
+
+
+
+
+# simple moving average
+class sma(indicator):
+  'Simple moving average'
+
+  def reset(self):
+    self.value = np.nan
+    self.last = deque(maxlen=self.window)
+    self.total = 0.0
+
+  # batch: one value per element of values (oldest first)
+  def compute(self, values):
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if len(x) >= self.window:
+      c = np.concatenate([[0.0], np.cumsum(x)])
+      out[self.window-1:] = (c[self.window:] - c[:-self.window])/self.window
+    self.last = deque(x[-self.window:].tolist(), maxlen=self.window)
+    self.total = sum(self.last)
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  # incremental: O(1) per day
+  def update(self, value):
+    if len(self.last) == self.window:
+      self.total -= self.last[0]
+    self.last.append(value)
+    self.total += value
+    self.value = self.total/self.window if len(self.last) == self.window else np.nan
+    return self.value
+
+
+# exponential moving average, seeded with the simple average of the first window days
+class ema(indicator):
+  'Exponential moving average with alpha = 2/(window+1)'
+
+  def reset(self):
+    self.value = np.nan
+    self.count = 0
+    self.total = 0.0
+    self.alpha = 2.0/(self.window + 1)
+
+  def compute(self, values):
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    w = self.window
+    if len(x) >= w:
+      out[w-1] = x[:w].mean()
+      out[w:] = _recurse(x[w:], self.alpha, out[w-1])
+    self.count = len(x)
+    self.total = x[:w].sum()
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  def update(self, value):
+    self.count += 1
+    if self.count < self.window:
+      self.total += value
+    elif self.count == self.window:
+      self.value = (self.total + value)/self.window
+    else:
+      self.value += self.alpha*(value - self.value)
+    return self.value
+
+
+# rolling minimum and maximum, using a monotonic deque for O(1) amortized updates
+class rolling_min(indicator):
+  'Lowest value over the last window days'
+
+  fields = ['Low']
+  sign = 1
+
+  def reset(self):
+    self.value = np.nan
+    self.count = 0
+    self.candidates = deque() # (day number, signed value), values increasing
+
+  def compute(self, values):
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if len(x) >= self.window:
+      out[self.window-1:] = self.sign*(self.sign*_windows(x, self.window)).min(axis=1)
+    self.reset()
+    for value in x[-self.window:].tolist():
+      self.update(value)
+    self.count = len(x)
+    self.candidates = deque((i + len(x) - min(len(x), self.window), v) for i, v in self.candidates)
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  def update(self, value):
+    v = self.sign*value
+    while self.candidates and self.candidates[-1][1] >= v:
+      self.candidates.pop()
+    self.candidates.append((self.count, v))
+    if self.candidates[0][0] <= self.count - self.window:
+      self.candidates.popleft()
+    self.count += 1
+    self.value = self.sign*self.candidates[0][1] if self.count >= self.window else np.nan
+    return self.value
+
+
+class rolling_max(rolling_min):
+  'Highest value over the last window days'
+
+  fields = ['High']
+  sign = -1
+
+
+# rolling (population) standard deviation
+# updates move the mean and the sum of squared deviations from it (Welford), never differencing large running sums,
+# and recompute both exactly from the window every window days so rounding cannot build up over a long history
+class rolling_std(indicator):
+  'Standard deviation over the last window days'
+
+  def reset(self):
+    self.value = np.nan
+    self.last = deque(maxlen=self.window)
+    self.mean = 0.0
+    self.squares = 0.0 # sum of squared deviations from mean
+    self.since = 0     # updates since the last exact recomputation
+
+  # exact two-pass mean and squared deviations of the window
+  def __recentre(self):
+    self.mean = sum(self.last)/len(self.last) if self.last else 0.0
+    self.squares = sum((v - self.mean)**2 for v in self.last)
+    self.since = 0
+
+  def compute(self, values):
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if len(x) >= self.window:
+      out[self.window-1:] = _windows(x, self.window).std(axis=1)
+    self.last = deque(x[-self.window:].tolist(), maxlen=self.window)
+    self.__recentre()
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  def update(self, value):
+    if len(self.last) == self.window: # value replaces the oldest one
+      old = self.last[0]
+      mean = self.mean + (value - old)/self.window
+      self.squares += (value - old)*(value - mean + old - self.mean)
+      self.mean = mean
+      self.last.append(value)
+    else:
+      self.last.append(value)
+      delta = value - self.mean
+      self.mean += delta/len(self.last)
+      self.squares += delta*(value - self.mean)
+    self.since += 1
+    if self.since >= self.window:
+      self.__recentre()
+    if len(self.last) < self.window:
+      self.value = np.nan
+    else:
+      self.value = math.sqrt(max(0.0, self.squares/self.window))
+    return self.value
+
+
+# average true range with Wilder smoothing
+class atr(indicator):
+  'Average true range, Wilder smoothed'
+
+  fields = ['High', 'Low', 'Close']
+
+  def reset(self):
+    self.value = np.nan
+    self.count = 0
+    self.total = 0.0
+    self.close = np.nan
+
+  def compute(self, highs, lows, closes):
+    h, l, c = [np.asarray(v, dtype=np.float64) for v in (highs, lows, closes)]
+    tr = h - l
+    if len(c) > 1:
+      tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(h[1:] - c[:-1]), np.abs(l[1:] - c[:-1])))
+    out = np.full(len(c), np.nan)
+    w = self.window
+    if len(c) >= w:
+      out[w-1] = tr[:w].mean()
+      out[w:] = _recurse(tr[w:], 1.0/w, out[w-1])
+    self.count = len(c)
+    self.total = tr[:w].sum()
+    self.close = c[-1] if len(c) else np.nan
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  def update(self, high, low, close):
+    tr = high - low
+    if self.count:
+      tr = max(tr, abs(high - self.close), abs(low - self.close))
+    self.close = close
+    self.count += 1
+    if self.count < self.window:
+      self.total += tr
+    elif self.count == self.window:
+      self.value = (self.total + tr)/self.window
+    else:
+      self.value += (tr - self.value)/self.window
+    return self.value
+
+
+# relative strength index with Wilder smoothing
+class rsi(indicator):
+  'Relative strength index, 100 when there were no losses in the window'
+
+  def reset(self):
+    self.value = np.nan
+    self.count = 0
+    self.gain = 0.0
+    self.loss = 0.0
+    self.close = np.nan
+
+  def compute(self, values):
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    w = self.window
+    d = np.diff(x)
+    gains, losses = np.maximum(d, 0), np.maximum(-d, 0)
+    if len(d) >= w:
+      g = np.concatenate([[gains[:w].mean()], _recurse(gains[w:], 1.0/w, gains[:w].mean())])
+      l = np.concatenate([[losses[:w].mean()], _recurse(losses[w:], 1.0/w, losses[:w].mean())])
+      with np.errstate(divide='ignore', invalid='ignore'):
+        out[w:] = np.where(l == 0, 100.0, 100.0 - 100.0/(1 + g/l))
+      self.gain, self.loss = g[-1], l[-1]
+    else:
+      self.gain, self.loss = gains.sum(), losses.sum()
+    self.count = len(d)
+    self.close = x[-1] if len(x) else np.nan
+    self.value = out[-1] if len(out) else np.nan
+    return out
+
+  def update(self, value):
+    if math.isnan(self.close): # first value, nothing to compare with
+      self.close = value
+      return self.value
+    change = value - self.close
+    self.close = value
+    self.count += 1
+    gain, loss = max(change, 0.0), max(-change, 0.0)
+    if self.count <= self.window:
+      self.gain += gain
+      self.loss += loss
+      if self.count < self.window:
+        return self.value
+      self.gain /= self.window
+      self.loss /= self.window
+    else:
+      self.gain += (gain - self.gain)/self.window
+      self.loss += (loss - self.loss)/self.window
+    self.value = 100.0 if self.loss == 0 else 100.0 - 100.0/(1 + self.gain/self.loss)
+    return self.value
+
+
+
+
+
+
+
+
+# full-history columns for an indicator's fields, oldest first
+def _columns(stock, ind, adjusted, start=False, end=False):
+  start = start or stock.earliest_date()
+  end = end or stock.latest_date()
+  return [np.asarray(getattr(stock, RANGE_METHODS[f])(start, end, adjusted), dtype=np.float64)[::-1] for f in ind.fields]
+
+
+# indicator over a stock's whole history, cached per ticker, indicator and window
+# the result is newest first like the stock's rows, so series(s, ind)[s.date_idx] is the value on s.date
+def series(stock, ind, adjusted=True):
+  first, latest = stock.earliest_date(), stock.latest_date()
+  key = (stock.ticker, ind.__class__.__name__, ind.window, tuple(ind.fields), adjusted, first, latest)
+  if key not in _series:
+    out = ind.compute(*_columns(stock, ind, adjusted))[::-1]
+    out.flags.writeable = False
+    _series[key] = out
+  return _series[key]
+
+
+# forget cached series, for one ticker or all of them
+def clear(ticker=False):
+  for key in _series.keys():
+    if not ticker or key[0] == ticker:
+      del _series[key]
+
+
+
+
+
+
+
+
+# incremental indicator that follows a stock's date
+class tracker:
+  'Keeps an indicator current as a stock (or portfolio) steps forward, at O(1) per new day'
+
+  def __init__(self, stock, ind, adjusted=True):
+    self.stock = stock
+    self.indicator = ind
+    self.adjusted = adjusted
+    self.day = False
+
+
+  # bring the indicator up to day (default: the stock's date) and return its value
+  # the first call computes the history in batch, later calls only feed the days since the last call
+  def update(self, day=False):
+    day = day or self.stock.date
+    if not self.day:
+      self.indicator.reset()
+      self.indicator.compute(*_columns(self.stock, self.indicator, self.adjusted, end=day))
+      self.day = day
+    elif day > self.day:
+      s = self.stock
+      if day == s.next_day(self.day):
+        bars = [[getattr(s, SCALAR_METHODS[f])(day, self.adjusted) for f in self.indicator.fields]]
+      else:
+        bars = zip(*_columns(s, self.indicator, self.adjusted, self.day + timedelta(days=1), day))
+      for bar in bars:
+        self.indicator.update(*bar)
+      self.day = day
+    return self.indicator.value
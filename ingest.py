@@ -0,0 +1,212 @@
+#! /opt/local/bin/python
+# ingest.py contains the bulk loader that downloads many tickers into data/ concurrently, and the offline csv import
+
+import sys, os, glob, time, threading
+import Queue
+import urllib2
+from datetime import timedelta
+import stock as stockmodule
+from stock import (QUOTE_URL, COMPACT_SEGMENTS, StockError, read_tickers, parse_csv, parse_columns, newer_rows,
+                   read_rows, write_rows, append_rows, save_columns, write_columns, delta_file)
+
+
+
+
+
+
+
+
+# concurrent downloader for a list of tickers
+class loader:
+  'Fetches and parses many tickers with a bounded pool of worker threads, collecting errors per ticker'
+
+  # workers bounds the number of open connections to base
+  # failed fetches are retried up to retries times, sleeping backoff, 2*backoff, 4*backoff, ... seconds in between
+  # incremental=True only downloads the days after what is already in a ticker's datfile, like stock.update
+  # rate limits the requests made to base per second, retries included (0 for no limit)
+  def __init__(self, tickers, base=QUOTE_URL, workers=16, retries=3, backoff=1.0, timeout=30, datadir='data/', incremental=True, rate=0):
+    self.tickers = list(tickers)
+    self.base = base
+    self.incremental = incremental
+    self.rate = rate
+    self.workers = workers
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.datadir = datadir
+
+    # results, filled in by run()
+    self.done = []         # tickers saved to their datfiles
+    self.errors = dict()   # ticker -> error message for tickers that could not be loaded
+    self.attempts = 0      # number of requests made, including retries
+    self.bytes = 0         # csv bytes downloaded
+    self.elapsed = 0.0     # seconds spent in run()
+    self.__start = 0.0
+    self.__next = 0.0      # earliest time the next request may be made, when rate limited
+    self.__lock = threading.Lock()
+
+
+  # string is the progress/throughput report
+  def __str__(self):
+    return self.report()
+
+
+  # wait for a request slot when rate limited, slots are handed out 1/rate seconds apart across all threads
+  def __throttle(self):
+    if not self.rate:
+      return
+    with self.__lock:
+      now = time.time()
+      wait = self.__next - now
+      self.__next = max(now, self.__next) + 1.0/self.rate
+    if wait > 0:
+      time.sleep(wait)
+
+
+  # download one ticker with retries, returns the raw csv text
+  # a missing ticker (HTTP 404) is not retried
+  def __fetch(self, ticker, start=False):
+    delay = self.backoff
+    for attempt in range(self.retries + 1):
+      self.__throttle()
+      with self.__lock:
+        self.attempts += 1
+      try:
+        return stockmodule.fetch(ticker, self.base, self.timeout, start) # through the module, so instrument sees it
+      except urllib2.HTTPError as e:
+        if e.code == 404:
+          raise StockError('Error: Ticker symbol ' + ticker + ' could not be found.')
+        error = 'Error: HTTP ' + str(e.code) + ' for ticker ' + ticker + '.'
+      except (urllib2.URLError, IOError) as e:
+        error = 'Error: Could not download ' + ticker + ' (' + str(e) + ').'
+      if attempt < self.retries:
+        time.sleep(delay)
+        delay *= 2
+    raise StockError(error)
+
+
+  # fetch, parse and save one ticker, returns the number of bytes downloaded
+  # datfiles are replaced atomically, see write_rows and append_rows
+  def load(self, ticker):
+    datfile = os.path.join(self.datadir, ticker + '.dat')
+    if self.incremental and os.path.isfile(datfile):
+      [rows, segments] = read_rows(datfile)
+      if rows:
+        text = self.__fetch(ticker, rows[0]['Date'] + timedelta(days=1))
+        new = newer_rows(rows, parse_csv(text))
+        if new and segments + 1 >= COMPACT_SEGMENTS:
+          write_rows(datfile, new + rows)
+        elif new:
+          append_rows(datfile, new)
+        return len(text)
+    text = self.__fetch(ticker)
+    columns = parse_columns(text)
+    if not len(columns['Date']):
+      raise StockError('Error: No data returned for ticker ' + ticker + '.')
+    save_columns(datfile, columns)
+    return len(text)
+
+
+  # worker thread: pull tickers off the queue until it is empty
+  def __work(self, queue, progress):
+    while True:
+      try:
+        ticker = queue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        size = self.load(ticker)
+      except StockError as e:
+        with self.__lock:
+          self.errors[ticker] = e.value
+      except Exception as e:
+        with self.__lock:
+          self.errors[ticker] = 'Error: ' + repr(e)
+      else:
+        with self.__lock:
+          self.done.append(ticker)
+          self.bytes += size
+      if progress:
+        with self.__lock:
+          finished = len(self.done) + len(self.errors)
+          if finished % progress == 0 or finished == len(self.tickers):
+            print self.report()
+            sys.stdout.flush()
+
+
+  # load every ticker, printing a progress report every progress tickers (0 for silent)
+  # returns the dictionary of per-ticker errors
+  def run(self, progress=100):
+    if not os.path.isdir(self.datadir):
+      os.makedirs(self.datadir)
+    queue = Queue.Queue()
+    for ticker in self.tickers:
+      queue.put(ticker)
+    self.__start = time.time()
+    threads = [threading.Thread(target=self.__work, args=(queue, progress)) for i in range(min(self.workers, len(self.tickers)))]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    for t in threads:
+      t.join()
+    self.elapsed = time.time() - self.__start
+    return self.errors
+
+
+  # one-line progress and throughput summary
+  def report(self):
+    elapsed = self.elapsed or (time.time() - self.__start if self.__start else 0.0)
+    finished = len(self.done) + len(self.errors)
+    rate = finished/elapsed if elapsed else 0.0
+    return '%d/%d tickers (%d failed, %d requests), %0.1f tickers/s, %0.1f KB/s' % (finished, len(self.tickers), len(self.errors), self.attempts, rate, self.bytes/1024.0/elapsed if elapsed else 0.0)
+
+
+
+
+
+
+
+
+# load every ticker in one or more exchange list files, e.g. load_lists('nyse.csv', 'nasdaq.csv', 'amex.csv')
+# keyword arguments are passed on to loader, returns the finished loader
+def load_lists(*listfiles, **kwargs):
+  progress = kwargs.pop('progress', 100)
+  l = loader(read_tickers(*listfiles), **kwargs)
+  l.run(progress)
+  return l
+
+
+# write datfiles from a directory of local csv dumps named <TICKER>.csv, in the csv format fetch() returns
+# binary=True writes memory-mapped binary datfiles, otherwise existing datfiles keep their format and new ones are pickled
+# existing datfiles and their delta segments are replaced
+# returns {ticker: error message} for the files that could not be parsed
+def import_csv(csvdir, datadir='data/', binary=True):
+  errors = dict()
+  if not os.path.isdir(datadir):
+    os.makedirs(datadir)
+  for csvfile in sorted(glob.glob(os.path.join(csvdir, '*.csv'))):
+    ticker = os.path.splitext(os.path.basename(csvfile))[0]
+    datfile = os.path.join(datadir, ticker + '.dat')
+    try:
+      columns = parse_columns(open(csvfile, 'rb').read())
+    except StockError as e:
+      errors[ticker] = e.value
+      continue
+    if binary:
+      write_columns(datfile, columns)
+      if os.path.isfile(delta_file(datfile)):
+        os.remove(delta_file(datfile))
+    else:
+      save_columns(datfile, columns)
+  return errors
+
+
+# python ingest.py [list files]   downloads every ticker in the lists (default: the three exchange lists)
+# python ingest.py --csv DIR      imports the csv dumps in DIR instead, offline
+if __name__ == '__main__':
+  if sys.argv[1:2] == ['--csv']:
+    errors = import_csv(sys.argv[2])
+  else:
+    errors = load_lists(*(sys.argv[1:] or ['nyse.csv', 'nasdaq.csv', 'amex.csv'])).errors
+  for ticker in sorted(errors):
+    print ticker + ': ' + errors[ticker]
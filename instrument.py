@@ -0,0 +1,156 @@
+#! /opt/local/bin/python
+# instrument.py contains opt-in counters and timers for the stock and portfolio hot paths
+#   import instrument
+#   instrument.enable(trace=callback)   # callback(info) after every portfolio.step
+#   ... run a backtest ...
+#   print instrument.report()
+# enable() swaps timing wrappers onto the instrumented methods and disable() puts the originals back,
+# so nothing is paid while instrumentation is off
+
+import threading
+from timeit import default_timer as clock
+import stock as stockmodule
+from stock import stock, portfolio, orderbook
+
+
+# instrumented call sites: (owner, attribute, counter name, argument holding the ticker or False)
+# stock methods take the ticker from self, fetch from its first argument
+HOOKS = [(stock, '_stock__load', 'load', 0),
+         (stock, '_stock__idx', 'lookup', 0),
+         (stock, '_stock__span', 'range', 0),
+         (stock, 'update', 'update', 0),
+         (stockmodule, 'fetch', 'fetch', 0),
+         (portfolio, '_portfolio__exec_orders', 'exec_orders', False),
+         (portfolio, '_portfolio__ibuy', 'buy', 1),
+         (portfolio, '_portfolio__isell', 'sell', 1),
+         (orderbook, 'triggered', 'triggered', 1)]
+
+# order types, named from whether an order has a limit and a stop
+ORDER_TYPES = {(False, False): 'market', (True, False): 'limit', (False, True): 'stop', (True, True): 'stop limit'}
+
+enabled = False
+_originals = []
+_trace = None
+_lock = threading.Lock()
+_counters = dict() # counter name -> [calls, seconds, {ticker: [calls, seconds]}]
+
+
+# add one timed call to a counter
+def _record(name, ticker, seconds):
+  with _lock:
+    counter = _counters.setdefault(name, [0, 0.0, dict()])
+    counter[0] += 1
+    counter[1] += seconds
+    if ticker:
+      per = counter[2].setdefault(ticker, [0, 0.0])
+      per[0] += 1
+      per[1] += seconds
+
+
+# ticker of a call, from a stock argument, self, or a plain ticker string
+def _ticker(args, position):
+  if position is False or len(args) <= position:
+    return False
+  arg = args[position]
+  return getattr(arg, 'ticker', arg if isinstance(arg, str) else False)
+
+
+# timing wrapper around one call site
+def _wrap(original, name, position):
+  def wrapper(*args, **kwargs):
+    start = clock()
+    try:
+      return original(*args, **kwargs)
+    finally:
+      _record(name, _ticker(args, position), clock() - start)
+  return wrapper
+
+
+# orderbook.triggered wrapper, which also tallies the orders it hands out by side and type, e.g. 'buy limit'
+def _wrap_triggered(original):
+  def triggered(self, ticker, low, high):
+    start = clock()
+    seqs = original(self, ticker, low, high)
+    _record('triggered', ticker, clock() - start)
+    side = 'buy ' if self.buy else 'sell '
+    for seq in set(seqs):
+      o = self.orders[seq]
+      _record(side + ORDER_TYPES[(bool(o.limit), bool(o.stop))], ticker, 0.0)
+    return seqs
+  return triggered
+
+
+# portfolio.step wrapper, which also hands a per-step summary to the trace callback
+def _wrap_step(original):
+  def step(self, *args, **kwargs):
+    before = dict((name, c[0]) for name, c in _counters.items())
+    start = clock()
+    original(self, *args, **kwargs)
+    seconds = clock() - start
+    _record('step', False, seconds)
+    if _trace:
+      counts = dict((name, c[0] - before.get(name, 0)) for name, c in _counters.items() if c[0] != before.get(name, 0))
+      _trace({'date': self.date, 'seconds': seconds, 'counts': counts, 'positions': len(self.positions),
+              'buy_orders': len(self.buy_orders), 'sell_orders': len(self.sell_orders)})
+  return step
+
+
+
+
+
+
+
+
+# turn instrumentation on, optionally calling trace(info) after every portfolio.step
+def enable(trace=None):
+  global enabled, _trace
+  _trace = trace
+  if enabled:
+    return
+  for owner, attr, name, position in HOOKS + [(portfolio, 'step', 'step', False)]:
+    original = getattr(owner, '__dict__')[attr]
+    _originals.append((owner, attr, original))
+    if attr == 'step':
+      setattr(owner, attr, _wrap_step(original))
+    elif attr == 'triggered':
+      setattr(owner, attr, _wrap_triggered(original))
+    else:
+      setattr(owner, attr, _wrap(original, name, position))
+  enabled = True
+
+
+# turn instrumentation off, restoring the original methods; the counters are kept
+def disable():
+  global enabled, _trace
+  while _originals:
+    owner, attr, original = _originals.pop()
+    setattr(owner, attr, original)
+  _trace = None
+  enabled = False
+
+
+# clear the counters
+def reset():
+  with _lock:
+    _counters.clear()
+
+
+# snapshot of the counters: {name: {'calls': n, 'seconds': s, 'tickers': {ticker: {'calls': n, 'seconds': s}}}}
+def stats():
+  with _lock:
+    return dict((name, {'calls': c[0], 'seconds': c[1],
+                        'tickers': dict((t, {'calls': p[0], 'seconds': p[1]}) for t, p in c[2].items())})
+                for name, c in _counters.items())
+
+
+# readable summary of the counters, with the top tickers by time for each
+def report(top=5):
+  lines = ['%-16s %10s %10s %12s' % ('counter', 'calls', 'seconds', 'us/call')]
+  snapshot = stats()
+  for name in sorted(snapshot, key=lambda n: -snapshot[n]['seconds']):
+    c = snapshot[name]
+    lines.append('%-16s %10d %10.3f %12.1f' % (name, c['calls'], c['seconds'], 1e6*c['seconds']/max(1, c['calls'])))
+    for ticker in sorted(c['tickers'], key=lambda t: -c['tickers'][t]['seconds'])[:top]:
+      t = c['tickers'][ticker]
+      lines.append('  %-14s %10d %10.3f' % (ticker, t['calls'], t['seconds']))
+  return '\n'.join(lines)
@@ -0,0 +1,25 @@
+#! /opt/local/bin/python
+# migrate.py converts pickled (or older binary) datfiles in data/ to the memory-mapped binary format
+
+import sys, os, glob
+from stock import BINARY_MAGIC, magic, read_rows, write_columns, columns_from_rows, delta_file
+
+
+# convert one datfile to the current binary format, folding in its delta segments
+# returns False if there was nothing to do
+def migrate(datfile):
+  if magic(datfile) == BINARY_MAGIC and not os.path.isfile(delta_file(datfile)):
+    return False
+  write_columns(datfile, columns_from_rows(read_rows(datfile)[0]))
+  if os.path.isfile(delta_file(datfile)):
+    os.remove(delta_file(datfile))
+  return True
+
+
+if __name__ == '__main__':
+  datadir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+  converted = 0
+  for datfile in sorted(glob.glob(os.path.join(datadir, '*.dat'))):
+    if migrate(datfile):
+      converted += 1
+  print 'Converted %d datfiles in %s' % (converted, datadir)
@@ -0,0 +1,209 @@
+#! /opt/local/bin/python
+# refresh.py contains the refresh service, which updates datfiles on behalf of many backtest processes
+#   python refresh.py [--port 8765] [--base URL] [--rate 5]      # run the service next to data/
+#   errors = refresh.request(['AAPL', 'MSFT'])                    # ask it for updates, from any process
+# requests for a ticker that is already being updated wait for that update instead of starting another,
+# the upstream is rate limited across all clients, and datfiles are replaced atomically so readers never see partial data
+#
+# protocol: one line per request, tickers separated by spaces; the reply is one line per ticker, in order,
+# 'OK <ticker>' or 'ERROR <ticker> <message>'; the line 'STATS' replies with the counters as JSON
+
+import sys, time, json, socket, threading, argparse
+import Queue
+import SocketServer
+from stock import QUOTE_URL, StockError
+from ingest import loader
+
+
+# where the service listens by default
+ADDRESS = ('127.0.0.1', 8765)
+
+
+
+
+
+
+
+
+# datfile updates with coalescing, shared by every connection to the service
+class refresher:
+  'Updates tickers through one rate-limited loader, running at most one update per ticker at a time'
+
+  # workers bounds the updates running at once and rate the upstream requests per second (0 for no limit)
+  # a ticker updated less than fresh seconds ago is not fetched again
+  def __init__(self, base=QUOTE_URL, workers=8, rate=5, fresh=60, retries=3, backoff=1.0, timeout=30, datadir='data/'):
+    self.loader = loader([], base, workers, retries, backoff, timeout, datadir, True, rate)
+    self.fresh = fresh
+    self.workers = workers
+    self.inflight = dict() # ticker -> [threading.Event, error message or False] for updates being run
+    self.finished = dict() # ticker -> [time finished, error message or False] for the latest update
+    self.requests = 0      # tickers asked for
+    self.coalesced = 0     # tickers answered by an update that was running or fresh
+    self.updates = 0       # updates run
+    self.bytes = 0         # csv bytes downloaded
+    self.__slots = threading.BoundedSemaphore(workers)
+    self.__lock = threading.Lock()
+
+
+  # update a ticker, or wait for the update already running for it; returns an error message or False
+  def refresh(self, ticker):
+    with self.__lock:
+      self.requests += 1
+      last = self.finished.get(ticker)
+      if last and not last[1] and time.time() - last[0] < self.fresh:
+        self.coalesced += 1
+        return False
+      entry = self.inflight.get(ticker)
+      waiting = bool(entry)
+      if waiting:
+        self.coalesced += 1
+      else:
+        entry = self.inflight[ticker] = [threading.Event(), False]
+    if waiting:
+      entry[0].wait()
+      return entry[1]
+    size = 0
+    with self.__slots:
+      try:
+        size = self.loader.load(ticker)
+      except StockError as e:
+        entry[1] = e.value
+      except Exception as e:
+        entry[1] = 'Error: ' + repr(e)
+    with self.__lock:
+      self.updates += 1
+      self.bytes += size
+      self.finished[ticker] = [time.time(), entry[1]]
+      del self.inflight[ticker]
+    entry[0].set()
+    return entry[1]
+
+
+  # refresh several tickers at once, returns {ticker: error message} for the ones that failed
+  # the tickers are queued for at most workers threads, like loader.run, however many are asked for
+  def refresh_all(self, tickers):
+    errors = dict()
+    queue = Queue.Queue()
+    for ticker in set(tickers):
+      queue.put(ticker)
+    def run():
+      while True:
+        try:
+          ticker = queue.get_nowait()
+        except Queue.Empty:
+          return
+        error = self.refresh(ticker)
+        if error:
+          errors[ticker] = error
+    threads = [threading.Thread(target=run) for i in range(min(self.workers, queue.qsize()))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    return errors
+
+
+  # snapshot of the counters
+  def stats(self):
+    with self.__lock:
+      return {'requests': self.requests, 'coalesced': self.coalesced, 'updates': self.updates,
+              'inflight': len(self.inflight), 'upstream requests': self.loader.attempts, 'bytes': self.bytes}
+
+
+
+
+
+
+
+
+# one client connection
+class handler(SocketServer.StreamRequestHandler):
+  'Answers request lines from one client'
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      words = line.split()
+      if words == ['STATS']:
+        self.wfile.write(json.dumps(self.server.refresher.stats()) + '\n')
+        continue
+      errors = self.server.refresher.refresh_all(words)
+      for ticker in words:
+        if ticker in errors:
+          self.wfile.write('ERROR %s %s\n' % (ticker, errors[ticker].replace('\n', ' ')))
+        else:
+          self.wfile.write('OK %s\n' % ticker)
+      self.wfile.flush()
+
+
+# the service, a threaded TCP server around a refresher
+class server(SocketServer.ThreadingTCPServer):
+  'Local refresh service'
+
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, address=ADDRESS, **kwargs):
+    SocketServer.ThreadingTCPServer.__init__(self, address, handler)
+    self.refresher = refresher(**kwargs)
+
+
+# start a service on a background thread, returns the server (call shutdown() to stop it)
+def serve(address=ADDRESS, **kwargs):
+  s = server(address, **kwargs)
+  t = threading.Thread(target=s.serve_forever)
+  t.daemon = True
+  t.start()
+  return s
+
+
+
+
+
+
+
+
+# ask a running service to update tickers and wait for it, returns {ticker: error message} for the ones that failed
+def request(tickers, address=ADDRESS, timeout=None):
+  tickers = list(tickers)
+  errors = dict()
+  if not tickers:
+    return errors
+  conn = socket.create_connection(address, timeout)
+  try:
+    f = conn.makefile('rb')
+    conn.sendall(' '.join(tickers) + '\n')
+    for ticker in tickers:
+      line = f.readline()
+      if not line:
+        raise StockError('Error: Refresh service closed the connection.')
+      words = line.rstrip('\n').split(' ', 2)
+      if words[0] == 'ERROR':
+        errors[words[1]] = words[2] if len(words) > 2 else 'Error: Unknown.'
+  finally:
+    conn.close()
+  return errors
+
+
+# counters of a running service
+def stats(address=ADDRESS, timeout=None):
+  conn = socket.create_connection(address, timeout)
+  try:
+    conn.sendall('STATS\n')
+    return json.loads(conn.makefile('rb').readline())
+  finally:
+    conn.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Serve datfile updates to local backtest processes.')
+  parser.add_argument('--host', default=ADDRESS[0])
+  parser.add_argument('--port', type=int, default=ADDRESS[1])
+  parser.add_argument('--base', default=QUOTE_URL, help='upstream csv url, the ticker is appended')
+  parser.add_argument('--rate', type=float, default=5, help='upstream requests per second')
+  parser.add_argument('--workers', type=int, default=8, help='updates running at once')
+  parser.add_argument('--fresh', type=float, default=60, help='seconds an update is reused for')
+  args = parser.parse_args()
+  s = server((args.host, args.port), base=args.base, rate=args.rate, workers=args.workers, fresh=args.fresh)
+  print 'Refreshing data/ on %s:%d' % (args.host, args.port)
+  sys.stdout.flush()
+  s.serve_forever()
@@ -0,0 +1,155 @@
+#! /opt/local/bin/python
+# screener.py contains the screener object, which filters and ranks a whole universe of tickers day by day
+#   s = screener(universe(read_tickers('nyse.csv', 'nasdaq.csv', 'amex.csv'), date(2000, 1, 1)))
+#   breakouts = s.crossed_above(s.field('Close'), s.shift(s.rolling_max('High', 50), 1))
+#   liquid = s.average('Volume', 20)
+#   s.filter(breakouts, day)              # tickers whose close crossed above their previous 50-day high
+#   s.rank(liquid, day, top=100)          # top 100 by average volume over the last 20 days
+# every expression is a days x tickers matrix computed once for the whole panel,
+# so screening a simulated day is a row lookup and a sort over the cross-section
+
+import numpy as np
+from stock import StockError
+
+
+# universe matrices for each field an expression can read
+FIELDS = {'Open': 'opens', 'High': 'highs', 'Low': 'lows', 'Close': 'closes', 'Volume': 'volumes'}
+
+
+# sum over the last window rows of each column, NaN for the first window-1 rows
+def _rolling_sum(x, window):
+  out = np.full(x.shape, np.nan)
+  if len(x) >= window:
+    c = np.concatenate([np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0)])
+    out[window-1:] = c[window:] - c[:-window]
+  return out
+
+
+# rolling extreme (f is np.fmax or np.fmin) over the last window rows of each column
+# doubles the span covered by each row until it reaches half the window, then combines two overlapping spans,
+# so it takes O(log window) passes over the panel instead of window
+def _rolling_extreme(x, window, f):
+  out = np.full(x.shape, np.nan)
+  if len(x) < window:
+    return out
+  m = x
+  span = 1
+  while span*2 <= window:
+    m = f(m[:-span], m[span:]) # m[i] now covers x[i:i+2*span]
+    span *= 2
+  out[window-1:] = f(m[:len(x)-window+1], m[window-span:])
+  return out
+
+
+
+
+
+
+
+
+# cross-sectional screener over a universe
+class screener:
+  'Vectorized filters and rankings over an aligned date x ticker panel'
+
+  # initialize with a universe object (see backtest.py)
+  def __init__(self, universe):
+    self.universe = universe
+    self.tickers = np.array(universe.tickers, dtype=object)
+    self.__cache = dict()
+
+
+  # string is the universe it screens
+  def __str__(self):
+    return repr('screener over %d tickers and %d days' % (len(self.universe.tickers), len(self.universe.days)))
+
+
+  # row of the panel for a day: the day itself, or the last trading day before it
+  def row(self, day):
+    i = int(np.searchsorted(self.universe.days, day.toordinal(), 'right')) - 1
+    if i < 0:
+      raise StockError('Error: No data in the universe on or before ' + str(day) + '.')
+    return i
+
+
+  # computed matrix for a key, built once
+  def __cached(self, key, build):
+    if key not in self.__cache:
+      m = build()
+      m.flags.writeable = False
+      self.__cache[key] = m
+    return self.__cache[key]
+
+
+  # forget computed matrices
+  def clear(self):
+    self.__cache.clear()
+
+
+  # raw field matrix, e.g. field('Close')
+  def field(self, name):
+    if name not in FIELDS:
+      raise StockError('Error: Unknown field ' + name + '.')
+    return getattr(self.universe, FIELDS[name])
+
+
+  # rolling statistics of a field over the last window trading days, NaN unless the ticker has a bar on all of them
+  def average(self, name, window):
+    def build():
+      x = self.field(name)
+      valid = _rolling_sum(np.isfinite(x).astype(np.float64), window)
+      with np.errstate(invalid='ignore'):
+        return np.where(valid == window, _rolling_sum(np.nan_to_num(x), window)/window, np.nan)
+    return self.__cached(('average', name, window), build)
+
+
+  def rolling_max(self, name, window):
+    return self.__cached(('max', name, window), lambda: self.__extreme(name, window, np.fmax))
+
+
+  def rolling_min(self, name, window):
+    return self.__cached(('min', name, window), lambda: self.__extreme(name, window, np.fmin))
+
+
+  def __extreme(self, name, window, f):
+    x = self.field(name)
+    valid = _rolling_sum(np.isfinite(x).astype(np.float64), window)
+    out = _rolling_extreme(x, window, f)
+    out[~(valid == window)] = np.nan
+    return out
+
+
+  # matrix moved forward by n trading days, so row d holds the value from n days earlier
+  def shift(self, m, n=1):
+    out = np.full(m.shape, np.nan)
+    if n < len(m):
+      out[n:] = m[:len(m)-n]
+    return out
+
+
+  # mask of the days where a rose above b, having been at or below it the day before
+  def crossed_above(self, a, b):
+    with np.errstate(invalid='ignore'):
+      return (a > b) & (self.shift(a) <= self.shift(b))
+
+
+  def crossed_below(self, a, b):
+    return self.crossed_above(b, a)
+
+
+  # tickers where mask (a boolean matrix) is true on day, in universe order
+  def filter(self, mask, day):
+    return self.tickers[np.asarray(mask[self.row(day)], dtype=bool)].tolist()
+
+
+  # tickers ranked by values (a matrix) on day, highest first unless ascending
+  # tickers with no value are left out, top limits the result, and among (a boolean matrix) restricts it
+  def rank(self, values, day, top=False, ascending=False, among=None):
+    i = self.row(day)
+    v = values[i]
+    cols = np.nonzero(np.isfinite(v) & (True if among is None else np.asarray(among[i], dtype=bool)))[0]
+    keys = v[cols] if ascending else -v[cols]
+    if top and top < len(cols):
+      part = np.argpartition(keys, top - 1)[:top]
+      cols, keys = cols[part], keys[part]
+    order = np.lexsort((cols, keys)) # ties in universe order
+    return self.tickers[cols[order]].tolist()
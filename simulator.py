@@ -0,0 +1,72 @@
+#! /opt/local/bin/python
+# simulator.py contains the simulator object, which steps many portfolios through the same days in lockstep
+# each day's bar for a ticker is looked up once and shared by every portfolio's order execution and valuation
+
+import numpy as np
+from stock import StockError
+
+
+# lockstep driver for a set of portfolios
+class simulator:
+  'Advances many portfolios one trading day at a time on a shared date cursor and shared daily bars'
+
+  # portfolios must start on the same date and step through the same calendar (the same sessions, as the default
+  # calendar is rebuilt whenever the cache reloads AAPL, so portfolios made at different times hold different objects)
+  # strategies, if given, has one callable per portfolio, called as strategy(portfolio) before every step
+  def __init__(self, portfolios, strategies=[]):
+    if not portfolios:
+      raise StockError('Error: A simulator needs at least one portfolio.')
+    if strategies and len(strategies) != len(portfolios):
+      raise StockError('Error: A simulator needs one strategy per portfolio.')
+    self.portfolios = list(portfolios)
+    self.strategies = list(strategies)
+    self.calendar = self.portfolios[0].calendar
+    self.date = self.portfolios[0].date
+    for p in self.portfolios:
+      if p.date != self.date or not np.array_equal(p.calendar.days, self.calendar.days):
+        raise StockError('Error: Portfolios in a simulator must share their date and calendar.')
+    self.bars = dict()                              # the current day's bars by ticker, shared by every portfolio
+    self.days = []                                  # dates stepped through, filled in by run()
+    self.equity = np.zeros((len(self.portfolios), 0)) # portfolio value after every step, portfolios x days
+    self.cash = np.zeros((len(self.portfolios), 0))   # portfolio money after every step, portfolios x days
+    self.traded = np.zeros((len(self.portfolios), 0)) # value bought and sold in every step, portfolios x days
+
+
+  # string is the number of portfolios and the date
+  def __str__(self):
+    return repr('%d portfolios on %s' % (len(self.portfolios), self.date))
+
+
+  # step every portfolio to the next trading day, sharing the day's bars between them
+  def step(self):
+    self.bars = dict()
+    for p in self.portfolios:
+      p.step(self.bars)
+    self.date = self.portfolios[0].date
+
+
+  # run the strategies and step for a number of days, recording each portfolio's value, money and trading
+  # returns the equity matrix (portfolios x days, appended to any earlier run)
+  def run(self, days):
+    equity = np.zeros((len(self.portfolios), days))
+    cash = np.zeros((len(self.portfolios), days))
+    traded = np.zeros((len(self.portfolios), days))
+    for i in range(days):
+      for p, strategy in zip(self.portfolios, self.strategies):
+        strategy(p)
+      self.step()
+      self.days.append(self.date)
+      for j, p in enumerate(self.portfolios):
+        equity[j, i] = p.value
+        cash[j, i] = p.money
+        traded[j, i] = p.history['traded'][p.steps - 1]
+    self.equity = np.hstack([self.equity, equity])
+    self.cash = np.hstack([self.cash, cash])
+    self.traded = np.hstack([self.traded, traded])
+    return self.equity
+
+
+  # final state of every portfolio, one dictionary each: value, money, date and the shares held
+  def results(self):
+    return [{'value': p.value, 'money': p.money, 'date': p.date,
+             'shares': dict((t, n) for t, n in p.shares.items() if n)} for p in self.portfolios]
@@ -1,17 +1,46 @@
 #! /opt/local/bin/python
 # stock.py contains StockError, stock object defintion, and portfolio object definition
 
-import sys, os, csv, math
-import urllib2
-from datetime import datetime, date, timedelta
+import sys, os, math, threading, bisect, heapq
+import urllib, urllib2
+from datetime import date, timedelta
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
-from matplotlib import lines, rc
+from matplotlib import rc, dates
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import cPickle as pickle
 
 
+# price columns in the yahoo csv, stored as float64 by the columnar backend
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+# historical quotes are requested from QUOTE_URL + ticker, pass another base to use a mirror or a local stand-in
+QUOTE_URL = 'http://ichart.finance.yahoo.com/table.csv?s='
+
+# incremental updates of pickled datfiles append their new rows to a delta file next to the datfile, one pickled segment
+# per update; once a ticker has COMPACT_SEGMENTS segments they are folded back into the datfile
+# binary datfiles are rewritten with the new rows instead, so they can always be mapped whole (see append_rows)
+COMPACT_SEGMENTS = 20
+
+# split/dividend adjusted columns, computed once from the raw ones by adjust_columns() (adjust_rows() for row dicts)
+ADJUSTED_COLUMNS = [('Adj Factor', '<f8'), ('Adj Open', '<f8'), ('Adj High', '<f8'), ('Adj Low', '<f8'), ('Adj Volume', '<i8')]
+
+# binary datfiles start with a magic string and the row count (BINARY_HEADER bytes in all)
+# followed by each column of their layout as a little-endian 8-byte array, newest row first
+# files are written with BINARY_MAGIC, which includes the adjusted columns; PRYSMS01 files are still read
+BINARY_MAGIC = 'PRYSMS02'
+BINARY_HEADER = 16
+BINARY_COLUMNS = [('Date', '<i8'), ('Open', '<f8'), ('High', '<f8'), ('Low', '<f8'), ('Close', '<f8'), ('Adj Close', '<f8'), ('Volume', '<i8')]
+BINARY_LAYOUTS = {'PRYSMS01': BINARY_COLUMNS, 'PRYSMS02': BINARY_COLUMNS + ADJUSTED_COLUMNS}
+
+# date ordinal of day 0 of numpy's datetime64
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
 class StockError(Exception):
   'Base class for execptions raised in this program'
   def __init__(self, value):
@@ -26,19 +55,413 @@ class StockError(Exception):
 
 
 
+# read tickers from exchange list files like nyse.csv, one ticker per line
+# the lists write share classes and warrants with a slash (BRK/B, AIG/WS), which cannot be part of a datfile name,
+# so they are read in yahoo's form with a dash instead (BRK-B)
+def read_tickers(*listfiles):
+  tickers = []
+  seen = set()
+  for listfile in listfiles:
+    for line in open(listfile):
+      ticker = line.strip().replace('/', '-')
+      if ticker and ticker not in seen:
+        seen.add(ticker)
+        tickers.append(ticker)
+  return tickers
+
+
+# download the csv history of a ticker, returns the raw csv text
+# start (a datetime.date object) limits the download to that day and later
+# urllib2 errors are passed through so callers can decide whether to retry
+def fetch(ticker, base=QUOTE_URL, timeout=None, start=False):
+  url = base + urllib.quote(ticker, safe='')
+  if start:
+    url += '&a=%d&b=%d&c=%d' % (start.month-1, start.day, start.year)
+  if timeout:
+    return urllib2.urlopen(url, timeout=timeout).read()
+  return urllib2.urlopen(url).read()
+
+
+# parse csv text straight into typed columns (see columns_from_rows), newest first and one row per date
+# the whole payload is split at once and each column converted by numpy, with the ISO dates read as datetime64
+def parse_columns(text):
+  lines = text.splitlines()
+  header = lines[0].split(',') if lines else []
+  body = [line for line in lines[1:] if line.strip()]
+  for name in ['Date'] + PRICE_COLUMNS + ['Volume']:
+    if name not in header:
+      raise StockError('Error: CSV data has no ' + name + ' column.')
+  fields = ','.join(body).split(',') if body else []
+  if len(fields) != len(body)*len(header):
+    raise StockError('Error: CSV data has rows with missing or extra fields.')
+  column = lambda name: fields[header.index(name)::len(header)]
+  try:
+    columns = {'Date': np.array(column('Date'), dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL}
+    for name in PRICE_COLUMNS:
+      columns[name] = np.array(column(name), dtype=np.float64)
+    columns['Volume'] = np.array(column('Volume'), dtype=np.float64).astype(np.int64)
+  except ValueError as e:
+    raise StockError('Error: Could not parse CSV data (' + str(e) + ').')
+  order = np.argsort(-columns['Date'], kind='mergesort')
+  keep = np.ones(len(order), dtype=bool)
+  keep[1:] = columns['Date'][order][1:] != columns['Date'][order][:-1] # first of each date in the payload
+  order = order[keep]
+  for name in columns:
+    columns[name] = columns[name][order]
+  return adjust_columns(columns)
+
+
+# parse csv text into row dicts, newest first, with the dates preconverted and the prices and volumes as numbers
+def parse_csv(text):
+  return rows_from_columns(parse_columns(text))
+
+
+# path of the delta file holding incremental segments for a datfile
+def delta_file(datfile):
+  return os.path.splitext(datfile)[0] + '.delta'
+
+
+# rows of new that are newer than everything in rows, newest first and one per date
+def newer_rows(rows, new):
+  latest = rows[0]['Date'] if rows else date.min
+  newer = dict((row['Date'], row) for row in new if row['Date'] > latest)
+  return [newer[day] for day in sorted(newer, reverse=True)]
+
+
+# parse csv row dicts into typed columns, dates are stored as ordinals
+def columns_from_rows(rows):
+  columns = {'Date': np.array([row['Date'].toordinal() for row in rows], dtype=np.int64)}
+  for name in PRICE_COLUMNS:
+    columns[name] = np.array([float(row[name]) for row in rows], dtype=np.float64)
+  columns['Volume'] = np.array([int(row['Volume']) for row in rows], dtype=np.int64)
+  return adjust_columns(columns)
+
+
+# add the split/dividend adjusted columns to a dictionary of raw columns
+# prices are scaled by Adj Close/Close and volume by its inverse, like the adjusted=True accessors
+# as in adjust_rows, a zero Close gives a NaN factor and a zero Close or Adj Close (old histories round to 0.00) a zero volume
+def adjust_columns(columns):
+  with np.errstate(divide='ignore', invalid='ignore'):
+    factor = np.where(columns['Close'] != 0, columns['Adj Close']/columns['Close'], np.nan)
+    columns['Adj Factor'] = factor
+    columns['Adj Open'] = factor*columns['Open']
+    columns['Adj High'] = factor*columns['High']
+    columns['Adj Low'] = factor*columns['Low']
+    scalable = np.isfinite(factor) & (factor != 0)
+    columns['Adj Volume'] = np.where(scalable, np.round(columns['Volume']/np.where(scalable, factor, 1.0)), 0).astype(np.int64)
+  return columns
+
+
+# row dicts for typed columns, in the same shape as parsed csv rows but with numeric values and the adjusted fields
+def rows_from_columns(columns):
+  names = PRICE_COLUMNS + ['Volume']
+  values = [columns[name].tolist() for name in names]
+  rows = []
+  for i, day in enumerate(columns['Date'].tolist()):
+    row = dict((name, column[i]) for name, column in zip(names, values))
+    row['Date'] = date.fromordinal(day)
+    rows.append(row)
+  return adjust_rows(rows)
+
+
+# add the adjusted fields of ADJUSTED_COLUMNS to the row dicts that lack them (rows pickled by older versions), in place
+# so the row backend scales by Adj Close/Close once at load time rather than on every access
+def adjust_rows(rows):
+  for row in rows:
+    if 'Adj Factor' in row:
+      continue
+    close, adj = float(row['Close']), float(row['Adj Close'])
+    factor = adj/close if close else float('nan')
+    row['Adj Factor'] = factor
+    row['Adj Open'] = factor*float(row['Open'])
+    row['Adj High'] = factor*float(row['High'])
+    row['Adj Low'] = factor*float(row['Low'])
+    row['Adj Volume'] = int(round(close/adj*float(row['Volume']))) if adj and close else 0
+  return rows
+
+
+# the magic string at the start of a datfile
+def magic(datfile):
+  f = open(datfile, 'rb')
+  magic = f.read(len(BINARY_MAGIC))
+  f.close()
+  return magic
+
+
+# whether a datfile is in a binary format rather than a pickle
+def is_binary(datfile):
+  return magic(datfile) in BINARY_LAYOUTS
+
+
+# map the columns of a binary datfile, pages are only read from disk when touched
+# the file is mapped once and every column is a view into that map, so a ticker holds one file descriptor
+# however many columns it has (each map keeps its own descriptor open)
+# PRYSMS01 files have no adjusted columns, so those are computed in memory
+def read_columns(datfile):
+  f = open(datfile, 'rb')
+  layout = BINARY_LAYOUTS[f.read(len(BINARY_MAGIC))]
+  rows = int(np.fromfile(f, dtype='<i8', count=1)[0])
+  f.close()
+  columns = dict()
+  buf = np.memmap(datfile, dtype=np.uint8, mode='r') if rows else None
+  for i, (name, dtype) in enumerate(layout):
+    if rows:
+      offset = BINARY_HEADER + i*8*rows
+      columns[name] = buf[offset:offset + 8*rows].view(dtype)
+    else:
+      columns[name] = np.zeros(0, dtype=dtype)
+  if 'Adj Factor' not in columns:
+    adjust_columns(columns)
+  return columns
+
+
+# temporary name next to a datfile, unique per process and thread, for writing it and renaming it into place
+# a rename within a directory is atomic, so readers see either the old file or the new one, never a partial write
+def temp_file(datfile):
+  return '%s.%d.%d.tmp' % (datfile, os.getpid(), threading.current_thread().ident)
+
+
+# write typed columns to a binary datfile
+# the file is written under a temporary name and renamed, so existing maps of the old file stay valid
+def write_columns(datfile, columns):
+  tmpfile = temp_file(datfile)
+  f = open(tmpfile, 'wb')
+  f.write(BINARY_MAGIC)
+  np.array([len(columns['Date'])], dtype='<i8').tofile(f)
+  if 'Adj Factor' not in columns:
+    adjust_columns(columns)
+  for name, dtype in BINARY_LAYOUTS[BINARY_MAGIC]:
+    np.asarray(columns[name], dtype=dtype).tofile(f)
+  f.close()
+  os.rename(tmpfile, datfile)
+
+
+# read the delta segments of a datfile, oldest first
+def read_segments(datfile):
+  segments = []
+  if os.path.isfile(delta_file(datfile)):
+    f = open(delta_file(datfile), 'rb')
+    while True:
+      try:
+        segments.append(pickle.load(f))
+      except EOFError:
+        break
+    f.close()
+  return segments
+
+
+# read a datfile in either format and fold in its delta segments, returns [rows, number of segments]
+def read_rows(datfile):
+  if is_binary(datfile):
+    rows = rows_from_columns(read_columns(datfile))
+  else:
+    rows = pickle.load(open(datfile, 'rb'))
+  segments = read_segments(datfile)
+  for segment in segments:
+    rows = newer_rows(rows, segment) + rows
+  return [adjust_rows(rows), len(segments)]
+
+
+# write typed columns to a datfile, keeping its current format (new datfiles are pickled), and drop any delta segments
+def save_columns(datfile, columns):
+  if os.path.isfile(datfile) and is_binary(datfile):
+    write_columns(datfile, columns)
+    if os.path.isfile(delta_file(datfile)):
+      os.remove(delta_file(datfile))
+  else:
+    write_rows(datfile, rows_from_columns(columns))
+
+
+# write the full history to a datfile, keeping its current format, and drop any delta segments
+def write_rows(datfile, rows):
+  if os.path.isfile(datfile) and is_binary(datfile):
+    write_columns(datfile, columns_from_rows(rows))
+  else:
+    tmpfile = temp_file(datfile)
+    f = open(tmpfile, 'wb')
+    pickle.dump(rows, f, -1)
+    f.close()
+    os.rename(tmpfile, datfile)
+  if os.path.isfile(delta_file(datfile)):
+    os.remove(delta_file(datfile))
+
+
+# add rows newer than everything stored to a datfile, returns whether they went into a new delta segment
+# a binary datfile is rewritten with the rows in front, so readers keep mapping one file rather than copying the
+# history to merge a delta into it; the rewrite is renamed into place, so existing maps of the old file stay valid
+# a pickled datfile gets one more segment in its delta file, which is small, so it is copied and renamed into place
+# rather than appended to, keeping the write atomic
+def append_rows(datfile, rows):
+  if os.path.isfile(datfile) and is_binary(datfile):
+    if os.path.isfile(delta_file(datfile)): # segments from before binary datfiles were rewritten
+      stored = read_rows(datfile)[0]
+      write_rows(datfile, newer_rows(stored, rows) + stored)
+    else:
+      columns = read_columns(datfile)
+      new = columns_from_rows(rows)
+      write_columns(datfile, dict((name, np.concatenate([new[name], columns[name]])) for name in new))
+    return False
+  delta = delta_file(datfile)
+  tmpfile = temp_file(delta)
+  f = open(tmpfile, 'wb')
+  if os.path.isfile(delta):
+    f.write(open(delta, 'rb').read())
+  pickle.dump(rows, f, -1)
+  f.close()
+  os.rename(tmpfile, delta)
+  return True
+
+
+# fold the delta segments of a datfile back into it
+def compact(datfile):
+  write_rows(datfile, read_rows(datfile)[0])
+
+
+
+
+
+
+
+
+# sorted array of trading sessions
+class tradingcalendar:
+  'Trading sessions as a sorted array of date ordinals, with O(1) next/previous session and date to index mapping'
+
+  # days are datetime.date objects or ordinals in any order, or a numpy array of ordinals already sorted and unique
+  # (a stock's own date index is used as is, without copying)
+  def __init__(self, days):
+    if not isinstance(days, np.ndarray):
+      days = np.unique(np.array([d.toordinal() if isinstance(d, date) else d for d in days], dtype=np.int64))
+    self.days = days
+    self.__first = int(days[0]) if len(days) else 0
+    self.__last = int(days[-1]) if len(days) else -1
+    self.__after = None # for each ordinal from the first session to the day after the last, index of the next session on or after it
+
+
+  # string is the number of sessions and their range
+  def __str__(self):
+    if not len(self.days):
+      return repr('empty calendar')
+    return repr('%d sessions from %s to %s' % (len(self.days), self.date(0), self.date(-1)))
+
+
+  def __len__(self):
+    return len(self.days)
+
+
+  # index of the first session on or after an ordinal, built on first use as one int32 per calendar day
+  def __position(self, ordinal):
+    if self.__after is None:
+      if not len(self.days):
+        return 0
+      span = np.arange(self.__first, self.__last + 2)
+      self.__after = np.searchsorted(self.days, span).astype(np.int32)
+    if ordinal <= self.__first:
+      return 0
+    if ordinal > self.__last:
+      return len(self.days)
+    return int(self.__after[ordinal - self.__first])
+
+
+  # session at an index, as a datetime.date object
+  def date(self, i):
+    return date.fromordinal(int(self.days[i]))
+
+
+  # index of a session
+  def index(self, day):
+    i = self.__position(day.toordinal())
+    if i == len(self.days) or self.days[i] != day.toordinal():
+      raise StockError('Error: ' + str(day) + ' is not a trading session.')
+    return i
+
+
+  # whether a day is a trading session
+  def is_session(self, day):
+    i = self.__position(day.toordinal())
+    return i < len(self.days) and self.days[i] == day.toordinal()
+
+
+  # first session after day
+  def next(self, day):
+    i = self.__position(day.toordinal() + 1)
+    if i == len(self.days):
+      raise StockError('Error: No trading session after ' + str(day) + '.')
+    return date.fromordinal(int(self.days[i]))
+
+
+  # last session before day
+  def prev(self, day):
+    i = self.__position(day.toordinal()) - 1
+    if i < 0:
+      raise StockError('Error: No trading session before ' + str(day) + '.')
+    return date.fromordinal(int(self.days[i]))
+
+
+  # number of sessions between two days (inclusive)
+  def count(self, start, end):
+    return max(0, self.__position(end.toordinal() + 1) - self.__position(start.toordinal()))
+
+
+  # sessions between two days (inclusive), as datetime.date objects
+  def sessions(self, start, end):
+    lo, hi = self.__position(start.toordinal()), self.__position(end.toordinal() + 1)
+    return [date.fromordinal(d) for d in self.days[lo:hi].tolist()]
+
+
+# calendar of every day on which any of the stocks traded
+def union_calendar(stocks):
+  if not stocks:
+    return tradingcalendar([])
+  return tradingcalendar(np.unique(np.concatenate([s.calendar.days for s in stocks])))
+
+
+# calendar of the weekdays between two days (inclusive), minus a list of holidays
+def weekday_calendar(start, end, holidays=[]):
+  days = np.arange(start.toordinal(), end.toordinal() + 1)
+  days = days[(days - 1) % 7 < 5] # ordinal 1 is a Monday
+  if holidays:
+    days = np.setdiff1d(days, [h.toordinal() for h in holidays])
+  return tradingcalendar(days)
+
+
+# the calendar portfolios step through unless given one: the sessions of the AAPL history, loaded once through the cache
+def default_calendar():
+  return cache.get('AAPL').calendar
+
+
+
+
+
+
+
+
 class stock:
   'Stock base class'
 
   # load on creation, but don't auto-update
   # if datfile doesn't exist, __load() will initialize it
-  def __init__(self, ticker):
+  # columnar=True parses the history once into numpy arrays instead of keeping csv row dicts
+  # prototype shares the price data of an already loaded stock instead of loading it, see stockcache
+  # start and end (datetime.date objects) keep only the history between them (inclusive); with a binary datfile
+  # and columnar=True the rest of the history is never read from disk, other datfiles are read whole and then cut
+  def __init__(self, ticker, columnar=False, prototype=False, start=False, end=False):
     self.ticker = ticker
     self.datfile = 'data/' + self.ticker + '.dat'
     self.data = []
+    self.columnar = columnar
+    self.start = start      # first and last day kept in memory, False for the whole history
+    self.end = end
+    self.columns = dict()   # column name -> numpy array, newest first like data (columnar only)
+    self.segments = 0       # incremental update segments in the delta file, see COMPACT_SEGMENTS
     self.date = date(2000, 1, 1) 
     self.date_idx = 0       # row number for this stock's date, for quick access
     self.date_data = dict() # data for this stock's date, for quick access
-    self.__load()
+    if prototype:
+      self.__adopt(prototype)
+      self.__window()
+    else:
+      self.__load()
 
 
   # string is just ticker
@@ -47,116 +470,253 @@ class stock:
 
 
   # use pickle
-  def update(self):
-    url = 'http://ichart.finance.yahoo.com/table.csv?s=' + self.ticker
+  # once there is data, only days after latest_date() are downloaded and added with append_rows
+  # full=True downloads the whole history again and rewrites the datfile
+  # a stock loaded with a date window only holds part of the datfile, so it cannot update it
+  def update(self, base=QUOTE_URL, full=False):
+    if (self.start or self.end) and (self.data or self.columns):
+      raise StockError('Error: Cannot update ' + self.ticker + ' while it is loaded with a date window.')
+    start = False
+    if not full and (self.data or self.columns):
+      start = self.latest_date() + timedelta(days=1)
     try:
-      response = urllib2.urlopen(url)
+      text = fetch(self.ticker, base, start=start)
     except urllib2.HTTPError:
       raise StockError('Error: Ticker symbol ' + self.ticker + ' could not be found.')
     except urllib2.URLError:
       raise StockError('Error: Check your internet connection.')
-    cr = csv.DictReader(response)
-    for row in cr:
-      row['Date'] = datetime.strptime(row['Date'], "%Y-%m-%d").date() # save time by preconverting dates
-      self.data.append(row)  # store csv data in memory for quick access
-    pickle.dump(self.data, open(self.datfile, 'wb'), -1)
+    if not start:
+      columns = parse_columns(text)
+      save_columns(self.datfile, columns)
+      self.segments = 0
+      if self.columnar:
+        self.columns = columns
+      else:
+        self.data = rows_from_columns(columns)  # store csv data in memory for quick access
+      self.__index()
+      self.__window()
+      return
+    rows = self.__merge(parse_csv(text))
+    if rows and append_rows(self.datfile, rows):
+      self.segments += 1
+      if self.segments >= COMPACT_SEGMENTS:
+        compact(self.datfile)
+        self.segments = 0
 
 
   # load data from datfile into memory
+  # binary datfiles are memory-mapped by the columnar backend instead of being read
   def __load(self):
-    if os.path.isfile(self.datfile):
-      self.data = pickle.load(open(self.datfile, 'rb'))
-    else:
+    if not os.path.isfile(self.datfile):
       self.update()
+    elif self.columnar and is_binary(self.datfile):
+      self.columns = read_columns(self.datfile)
+      self.__index()
+      segments = read_segments(self.datfile)
+      if self.end:
+        segments = [[row for row in segment if row['Date'] <= self.end] for segment in segments]
+      # cut the mapped columns before merging, so the merge only copies the window,
+      # unless the window starts after the datfile and only the segments have data for it
+      late = self.start and len(self.__keys) and self.__keys[-1] < self.start.toordinal()
+      if not late:
+        self.__window()
+      for segment in segments:
+        self.__merge(segment)
+      if late:
+        self.__window()
+      self.segments = len(segments)
+    else:
+      [self.data, self.segments] = read_rows(self.datfile)
+      if self.columnar:
+        self.columns = columns_from_rows(self.data)
+        self.data = []
+      self.__index()
+      self.__window()
+
+
+  # share the price data of another stock, keeping this stock's own date cursor
+  # data and columns are only ever replaced, never modified in place, so sharing them is safe
+  def __adopt(self, other):
+    self.data = other.data
+    self.columns = dict(other.columns)
+    self.segments = other.segments
+    self.__keys = other.__keys
+    self.calendar = other.calendar
+
+
+  # cut the price data down to the stock's date window, as views where the backend allows
+  def __window(self):
+    if not self.start and not self.end:
+      return
+    span = self.__span(self.start or self.earliest_date(), self.end or self.latest_date())
+    if self.columnar:
+      self.columns = dict((name, column[span]) for name, column in self.columns.items())
+    else:
+      self.data = self.data[span]
+    self.__index()
+
+
+  # whether any price column is a view of a memory-mapped datfile, which keeps a file descriptor open
+  def mapped(self):
+    return any(isinstance(column, np.memmap) for column in self.columns.values())
+
+
+  # approximate bytes of process memory held by the price data
+  # memory-mapped columns live in the OS page cache and are not counted, see mapped
+  def nbytes(self):
+    size = self.__keys.nbytes
+    for column in self.columns.values():
+      if not isinstance(column, np.memmap):
+        size += column.nbytes
+    if self.data:
+      row = self.data[0]
+      size += len(self.data)*(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()))
+    return size
+
+
+  # merge downloaded rows in front of the stored history, skipping days already stored
+  # returns the rows that were actually new
+  def __merge(self, rows):
+    if self.columnar:
+      latest = [{'Date': self.latest_date()}]
+    else:
+      latest = self.data
+    rows = newer_rows(latest, rows)
+    if not rows:
+      return rows
+    if self.columnar:
+      new = columns_from_rows(rows)
+      for name in self.columns:
+        self.columns[name] = np.concatenate([new[name], self.columns[name]])
+    else:
+      self.data = rows + self.data
+    if self.date_data:
+      self.date_idx += len(rows)  # rows are newest first, so the cursor moves down
+    self.__index()
+    return rows
+
+
+  # build the date index used by every lookup
+  # __keys holds the date ordinals oldest first, for the columnar backend as a reversed view that copies nothing
+  # position p in __keys is row number len(__keys)-1-p
+  # calendar holds the same ordinals as the stock's own trading sessions
+  def __index(self):
+    if self.columnar:
+      self.__keys = self.columns['Date'][::-1]
+    else:
+      self.__keys = np.array([row['Date'].toordinal() for row in reversed(self.data)], dtype=np.int64)
+    self.calendar = tradingcalendar(self.__keys)
+
+
+  # row number of a specific day, O(log n) with no copying
+  def __idx(self, day):
+    if day == self.date and self.date_data:
+      return self.date_idx
+    key = day.toordinal()
+    pos = np.searchsorted(self.__keys, key)
+    if pos == len(self.__keys) or self.__keys[pos] != key:
+      raise StockError('Error: No data found for date ' + str(day) + ' for stock ' + self.ticker)
+    return len(self.__keys) - 1 - int(pos)
+
+
+  # slice of rows between two days (inclusive)
+  def __span(self, start, end):
+    lo = int(np.searchsorted(self.__keys, start.toordinal(), 'left'))
+    hi = int(np.searchsorted(self.__keys, end.toordinal(), 'right'))
+    if lo >= hi:
+      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    return slice(len(self.__keys) - hi, len(self.__keys) - lo)
+
+
+  # price column value(s) at idx (row number or slice) from the columnar store
+  def __prices(self, name, idx, adjusted):
+    return self.columns['Adj ' + name if adjusted else name][idx]
+
+
+  # volume value(s) at idx (row number or slice) from the columnar store
+  def __volumes(self, idx, adjusted):
+    return self.columns['Adj Volume' if adjusted else 'Volume'][idx]
+
+
+  # row dict for a row number in the columnar store, in the same shape as the csv rows
+  def __rowdict(self, idx):
+    row = dict((name, self.columns[name][idx]) for name in PRICE_COLUMNS + ['Volume'])
+    row['Date'] = date.fromordinal(int(self.columns['Date'][idx]))
+    return row
 
 
   # grab latest date available, returns date object
   def latest_date(self):
+    if self.columnar:
+      return date.fromordinal(int(self.columns['Date'][0]))
     return self.data[0]['Date']
 
     
   # grab earliest date available, returns date object
   def earliest_date(self):
+    if self.columnar:
+      return date.fromordinal(int(self.columns['Date'][-1]))
     return self.data[-1]['Date']
 
 
   # set the date for this stock
   def set_date(self, date):
+    self.date_idx = self.__idx(date)
+    if self.columnar:
+      self.date_data = self.__rowdict(self.date_idx)
+    else:
+      self.date_data = self.data[self.date_idx]
     self.date = date
-    [self.date_data, self.date_idx] = self.__binsearch_idx(self.data, self.date)
 
 
   # step the date for this stock
   def step_date(self):
     self.date_idx -= 1
-    self.date_data = self.data[self.date_idx]
+    if self.columnar:
+      self.date_data = self.__rowdict(self.date_idx)
+    else:
+      self.date_data = self.data[self.date_idx]
     self.date = self.date_data['Date']
 
 
   # grab the data for a specific day, where day is a datetime.date object
   def __row(self, day):
-    if day == self.date:
-      return self.date_data
-    else:
-      return self.__binsearch(self.data, day)
-
-  
-  # binary search for data on a specific day
-  def __binsearch(self, subdata, day):
-    if len(subdata) == 0:
-      raise StockError('Error: No data found for date ' + str(day) + ' for stock ' + self.ticker)
-    else:
-      midpoint = len(subdata)//2
-      middata = subdata[midpoint]['Date']
-      if middata == day:
-        return subdata[midpoint]
-      else:
-        if day < middata:
-          return self.__binsearch(subdata[midpoint+1:], day)
-        else:
-          return self.__binsearch(subdata[:midpoint], day)
-
-
-  # binary search for data on a specific day, also returns index
-  def __binsearch_idx(self, subdata, day, idx=0):
-    if len(subdata) == 0:
-      raise StockError('Error: No data found for date ' + str(day))
-    else:
-      midpoint = len(subdata)//2
-      middata = subdata[midpoint]['Date']
-      if middata == day:
-        return [subdata[midpoint], idx+midpoint]
-      else:
-        if day < middata:
-          return self.__binsearch_idx(subdata[midpoint+1:], day, idx+midpoint+1)
-        else:
-          return self.__binsearch_idx(subdata[:midpoint], day, idx)
+    return self.data[self.__idx(day)]
 
 
   # grab the data for a range of days
   def __rows(self, start, end):
-    rows = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        rows.append(row)
-    if not rows:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
-    return rows
+    return self.data[self.__span(start, end)]
+
+
+  # get open, high, low and closing prices for a specific day with one lookup, as [open, high, low, close]
+  def bar(self, day, adjusted=True):
+    if self.columnar:
+      i = self.__idx(day)
+      return [float(self.__prices('Open', i, adjusted)), float(self.__prices('High', i, adjusted)),
+              float(self.__prices('Low', i, adjusted)), float(self.columns['Adj Close' if adjusted else 'Close'][i])]
+    row = self.__row(day)
+    if adjusted:
+      return [row['Adj Open'], row['Adj High'], row['Adj Low'], float(row['Adj Close'])]
+    return [float(row['Open']), float(row['High']), float(row['Low']), float(row['Close'])]
 
 
   # get closing price for a specific day
   # day must be a datetime.date object
   def close(self, day, adjusted=True):
+    if self.columnar:
+      return float(self.columns['Adj Close' if adjusted else 'Close'][self.__idx(day)])
     return float(self.__row(day)['Adj Close' if adjusted else 'Close'])
 
 
   # get opening price for a specific day
   # day must be a datetime.date object
   def open(self, day, adjusted=True):
+    if self.columnar:
+      return float(self.__prices('Open', self.__idx(day), adjusted))
     row = self.__row(day)
     if adjusted:
-      return float(row['Adj Close'])/float(row['Close'])*float(row['Open'])
+      return row['Adj Open']
     else:
       return float(row['Open'])
 
@@ -164,9 +724,11 @@ class stock:
   # get high price for a specific day
   # day must be a datetime.date object
   def high(self, day, adjusted=True):
+    if self.columnar:
+      return float(self.__prices('High', self.__idx(day), adjusted))
     row = self.__row(day)
     if adjusted:
-      return float(row['Adj Close'])/float(row['Close'])*float(row['High'])
+      return row['Adj High']
     else:
       return float(row['High'])
 
@@ -174,186 +736,576 @@ class stock:
   # get low price for a specific day
   # day must be a datetime.date object
   def low(self, day, adjusted=True):
+    if self.columnar:
+      return float(self.__prices('Low', self.__idx(day), adjusted))
     row = self.__row(day)
     if adjusted:
-      return float(row['Adj Close'])/float(row['Close'])*float(row['Low'])
+      return row['Adj Low']
     else:
       return float(row['Low'])
 
 
   # get volume for a specific day
   def volume(self, day, adjusted=True):
+    if self.columnar:
+      return int(self.__volumes(self.__idx(day), adjusted))
     row = self.__row(day)
     if adjusted:
-      return int(round(float(row['Close'])/float(row('Adj Close'))*row['Volume']))
+      return row['Adj Volume']
     else:
       return int(row['Volume'])
 
 
   # get average volume for a range of days
   def average_volume(self, start, end, adjusted=True):
+    if self.columnar:
+      return int(round(self.__volumes(self.__span(start, end), adjusted).mean()))
     vsum = 0
-    for row in self.__rows(start, end):
+    rows = self.__rows(start, end)
+    for row in rows:
       if adjusted:
-        vsum += int(round(float(row['Close'])/float(row('Adj Close'))*row['Volume']))
+        vsum += row['Adj Volume']
       else:
         vsum += int(row['Volume'])
     return int(round(vsum / float(len(rows))))
 
 
   # get closing prices for a range of days
+  # the columnar backend returns numpy arrays instead of lists
   def closes(self, start, end, adjusted=True):
+    if self.columnar:
+      return self.columns['Adj Close' if adjusted else 'Close'][self.__span(start, end)]
     closes = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        closes.append(float(row['Adj Close' if adjusted else 'Close']))
-    if not closes:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      closes.append(float(row['Adj Close' if adjusted else 'Close']))
     return closes
 
 
   # get opening prices for a range of days
   def opens(self, start, end, adjusted=True):
+    if self.columnar:
+      return self.__prices('Open', self.__span(start, end), adjusted)
     opens = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        if adjusted:
-          opens.append(float(row['Adj Close'])/float(row['Close'])*float(row['Open']))
-        else:
-          opens.append(float(row['Open']))
-    if not opens:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      if adjusted:
+        opens.append(row['Adj Open'])
+      else:
+        opens.append(float(row['Open']))
     return opens
 
 
   # get high prices for a range of days
   def highs(self, start, end, adjusted=True):
+    if self.columnar:
+      return self.__prices('High', self.__span(start, end), adjusted)
     highs = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        if adjusted:
-          highs.append(float(row['Adj Close'])/float(row['Close'])*float(row['High']))
-        else:
-          highs.append(float(row['High']))
-    if not highs:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      if adjusted:
+        highs.append(row['Adj High'])
+      else:
+        highs.append(float(row['High']))
     return highs
 
 
   # get low prices for a range of days
   def lows(self, start, end, adjusted=True):
+    if self.columnar:
+      return self.__prices('Low', self.__span(start, end), adjusted)
     lows = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        if adjusted:
-          lows.append(float(row['Adj Close'])/float(row['Close'])*float(row['Low']))
-        else:
-          lows.append(float(row['Low']))
-    if not lows:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      if adjusted:
+        lows.append(row['Adj Low'])
+      else:
+        lows.append(float(row['Low']))
     return lows
 
 
   # get volume for a range of days
   def volumes(self, start, end, adjusted=True):
+    if self.columnar:
+      return self.__volumes(self.__span(start, end), adjusted)
     volumes = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        if adjusted:
-          volumes.append(int(round(float(row['Close'])/float(row('Adj Close'))*row['Volume'])))
-        else:
-          volumes.append(int(row['Volume']))
-    if not volumes:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      if adjusted:
+        volumes.append(row['Adj Volume'])
+      else:
+        volumes.append(int(row['Volume']))
     return volumes
 
 
   # get trading days for a range of days
   def days(self, start, end):
+    if self.columnar:
+      return [date.fromordinal(d) for d in self.columns['Date'][self.__span(start, end)].tolist()]
     days = []
-    for row in self.data:
-      day = row['Date']
-      if day >= start and day <= end:
-        days.append(row['Date'])
-    if not days:
-      raise StockError('Error: No data found between dates ' + str(start) + ' and ' + str(end) + ' (inclusive)')
+    for row in self.__rows(start, end):
+      days.append(row['Date'])
     return days
 
 
+  # open, high, low and close columns for a range of days from one extraction, oldest first
+  # returns (date ordinals, opens, highs, lows, closes) as numpy arrays
+  def __ohlc(self, start, end, adjusted=True):
+    span = self.__span(start, end)
+    if self.columnar:
+      x = self.columns['Date'][span][::-1].astype(np.float64)
+      return [x] + [self.__prices(name, span, adjusted)[::-1] for name in ['Open', 'High', 'Low', 'Close']]
+    rows = self.data[span]
+    ohlc = np.empty((5, len(rows)))
+    for i, row in enumerate(reversed(rows)):
+      factor = row['Adj Factor'] if adjusted else 1.0
+      ohlc[:, i] = (row['Date'].toordinal(), factor*float(row['Open']), factor*float(row['High']),
+                    factor*float(row['Low']), factor*float(row['Close']))
+    return list(ohlc)
+
+
   # plots OHLC chart for a range of days
-  def plot_ohlc(self, start, end):
-    # not very efficient but quick for single plots
-    days = self.days(start, end)
-    bases = self.lows(start, end)
-    highs = self.highs(start, end)
-    deltas = np.array(highs)-np.array(bases)
-    closes = self.closes(start, end)
-    opens = self.opens(start, end)
-    green_days, green_deltas, green_bases, green_opens, green_closes = [], [], [], [], []
-    red_days, red_deltas, red_bases, red_opens, red_closes = [], [], [], [], []
-    for day, base, delta, o, c in zip(days, bases, deltas, opens, closes):
-      if o < c:
-        green_days.append(day)
-        green_deltas.append(delta)
-        green_bases.append(base)
-        green_opens.append(o)
-        green_closes.append(c)
-      else:
-        red_days.append(day)
-        red_deltas.append(delta)
-        red_bases.append(base)
-        red_opens.append(o)
-        red_closes.append(c)
-    width = 0
+  # with a filename the chart is rendered off screen and saved, in the format given by the extension (.png, .svg, ...)
+  # ranges with more bars than the axes have pixels are merged into one bar per group of days
+  def plot_ohlc(self, start, end, filename=False, adjusted=True, size=(16, 9), dpi=100):
+    x, opens, highs, lows, closes = self.__ohlc(start, end, adjusted)
     font = {'family' : 'normal',
             'weight' : 'bold',
             'size'   : 22}
     rc('font', **font)
-    ax = plt.axes()
-    rectsg = ax.bar(green_days, green_deltas, width, bottom=green_bases, color='#4CBB17', edgecolor='#4CBB17')
-    rectsr = ax.bar(red_days, red_deltas, width, bottom=red_bases, color='#FF0000', edgecolor='#FF0000')
+    if filename:
+      fig = Figure(figsize=size, dpi=dpi)
+      FigureCanvasAgg(fig)
+    else:
+      fig = plt.figure(figsize=size, dpi=dpi)
+    ax = fig.add_subplot(111)
+
+    # decimate to the pixel width of the axes: the first open, highest high, lowest low and last close of each group
+    pixels = max(1, int(ax.get_window_extent().width))
+    group = int(math.ceil(len(x)/float(pixels)))
+    if group > 1:
+      firsts = np.arange(0, len(x), group)
+      lasts = np.minimum(firsts + group, len(x)) - 1
+      x, opens, closes = x[firsts], opens[firsts], closes[lasts]
+      highs, lows = np.maximum.reduceat(highs, firsts), np.minimum.reduceat(lows, firsts)
+
+    # dates as matplotlib numbers, whatever epoch this matplotlib uses
+    x = x + (dates.date2num(date.fromordinal(1)) - 1)
+    w = 0.2*group
+    up = opens < closes
+    for mask, color in [(up, '#4CBB17'), (~up, '#FF0000')]:
+      xs, o, h, l, c = x[mask], opens[mask], highs[mask], lows[mask], closes[mask]
+      segments = np.concatenate([np.dstack([np.column_stack([xs, xs]), np.column_stack([l, h])]),
+                                 np.dstack([np.column_stack([xs - w, xs]), np.column_stack([o, o])]),
+                                 np.dstack([np.column_stack([xs, xs + w]), np.column_stack([c, c])])])
+      ax.add_collection(LineCollection(segments, colors=color))
+    ax.xaxis_date()
+    ax.set_xlim([x[0] - 1, x[-1] + 1])
     ax.set_yscale('log')
-    ymin = min(bases)*0.99
-    ymax = max(highs)*1.01
+    ymin = lows.min()*0.99
+    ymax = highs.max()*1.01
     ax.set_ylim([ymin, ymax])
     ax.yaxis.set_ticks(np.logspace(math.log10(ymin), math.log10(ymax), num=20))
     ax.set_yticks([], minor=True)
     ax.yaxis.set_major_formatter(ticker.FormatStrFormatter('%0.2f'))
-    plt.ylabel('Price (USD)')
-    plt.title(self.ticker)
-    for opening, closing, bar in zip(green_opens, green_closes, rectsg):
-      x, w = bar.get_x(), 0.2
-      ax.plot((x - w, x), (opening, opening), color='#4CBB17')
-      ax.plot((x, x + w), (closing, closing), color='#4CBB17')
-    for opening, closing, bar in zip(red_opens, red_closes, rectsr):
-      x, w = bar.get_x(), 0.2
-      ax.plot((x - w, x), (opening, opening), color='#FF0000')
-      ax.plot((x, x + w), (closing, closing), color='#FF0000')
-    plt.show()
+    ax.set_ylabel('Price (USD)')
+    ax.set_title(self.ticker)
+    if filename:
+      fig.savefig(filename)
+    else:
+      plt.show()
+    return fig
 
 
   # returns the next legal trading day after the specified day
   def next_day(self, day):
-    if day == self.date:
-      return self.data[self.date_idx-1]['Date']
+    try:
+      return self.calendar.next(day)
+    except StockError:
+      raise StockError('Error: No data for ' + self.ticker + ' after ' + str(day) + '.')
+
+
+
+
+
+
+
+
+# process-wide registry of loaded price data
+class stockcache:
+  'Shares loaded price data between stock instances, evicting the least recently used tickers beyond a memory budget'
+
+  # budget is in bytes, as counted by stock.nbytes()
+  # maps bounds the entries backed by memory-mapped datfiles, which cost file descriptors rather than memory
+  def __init__(self, budget=1 << 30, maps=512):
+    self.budget = budget
+    self.maps = maps
+    self.entries = OrderedDict() # (ticker, columnar, start, end) -> [prototype stock, bytes, datfile stamp, mapped], least recently used first
+    self.size = 0
+    self.mapped = 0 # entries whose prototype is memory-mapped
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.__lock = threading.Lock()
+
+
+  # modification times of a datfile and its delta file, so entries are reloaded after updates
+  def __stamp(self, datfile):
+    stamp = []
+    for f in [datfile, delta_file(datfile)]:
+      stamp.append(os.path.getmtime(f) if os.path.isfile(f) else 0)
+    return stamp
+
+
+  # get a stock with its own date cursor, sharing price data with every other stock from this cache
+  # start and end load only a date window of the history (see stock), cached separately from the whole history
+  def get(self, ticker, columnar=True, start=False, end=False):
+    key = (ticker, columnar, start, end)
+    datfile = 'data/' + ticker + '.dat'
+    with self.__lock:
+      entry = self.entries.pop(key, False)
+      if entry and entry[2] == self.__stamp(datfile):
+        self.hits += 1
+        self.entries[key] = entry
+        return stock(ticker, columnar, entry[0], start, end)
+      if entry:
+        self.__forget(entry)
+    # load outside the lock so other tickers are not held up by the disk or network
+    prototype = stock(ticker, columnar, start=start, end=end)
+    for column in prototype.columns.values():
+      column.flags.writeable = False
+    size = prototype.nbytes()
+    mapped = prototype.mapped()
+    with self.__lock:
+      self.misses += 1
+      if key not in self.entries:
+        self.entries[key] = [prototype, size, self.__stamp(datfile), mapped]
+        self.size += size
+        self.mapped += mapped
+      while (self.size > self.budget or self.mapped > self.maps) and len(self.entries) > 1:
+        [evicted, entry] = self.entries.popitem(last=False)
+        self.__forget(entry)
+        self.evictions += 1
+    return stock(ticker, columnar, prototype, start, end)
+
+
+  # forget a ticker, or every ticker
+  def drop(self, ticker=False):
+    with self.__lock:
+      for key in self.entries.keys():
+        if not ticker or key[0] == ticker:
+          self.__forget(self.entries.pop(key))
+
+
+  # take a removed entry out of the totals (call with the lock held)
+  def __forget(self, entry):
+    self.size -= entry[1]
+    self.mapped -= entry[3]
+
+
+  # snapshot of the cache counters
+  def stats(self):
+    with self.__lock:
+      return {'tickers': len(self.entries), 'bytes': self.size, 'budget': self.budget, 'mapped': self.mapped, 'maps': self.maps,
+              'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# the process-wide cache, e.g. cache.get('AAPL')
+cache = stockcache()
+
+
+
+
+
+
+
+
+# one resting buy or sell order, as made by portfolio.buy and portfolio.sell
+# limit, stop and exp are False when not given; order[i] still reads the fields as [stock, shares, limit, stop, exp]
+class order(object):
+  'Compact order record'
+
+  __slots__ = ('stock', 'shares', 'limit', 'stop', 'exp')
+
+  def __init__(self, stock, shares, limit=False, stop=False, exp=False):
+    self.stock = stock
+    self.shares = shares
+    self.limit = limit
+    self.stop = stop
+    self.exp = exp
+
+
+  def __getitem__(self, i):
+    return (self.stock, self.shares, self.limit, self.stop, self.exp)[i]
+
+
+  def __len__(self):
+    return 5
+
+
+  def __repr__(self):
+    return 'order(%s, %d, %r, %r, %r)' % (self.stock.ticker, self.shares, self.limit, self.stop, self.exp)
+
+
+# one open position of a portfolio
+class holding(object):
+  'Compact position record'
+
+  __slots__ = ('stock', 'shares', 'buyprice', 'maxprice', 'minprice', 'curprice')
+
+  def __init__(self, stock, shares, price):
+    self.stock = stock
+    self.shares = shares
+    self.buyprice = price # average price paid
+    self.maxprice = price # highest price seen since the position was opened, including daily highs
+    self.minprice = price # lowest price seen since the position was opened, including daily lows
+    self.curprice = price # latest (closing) price
+
+
+  def __repr__(self):
+    return 'holding(%s, %d, %r)' % (self.stock.ticker, self.shares, self.buyprice)
+
+
+# read-only ticker -> value dictionary over one field of a portfolio's holdings, e.g. portfolio.shares
+# tickers not held read as default if one is given, and raise KeyError otherwise
+class fieldview:
+  'Dictionary view of one holding field'
+
+  def __init__(self, holdings, field, default=KeyError):
+    self.holdings = holdings
+    self.field = field
+    self.default = default
+
+
+  def __getitem__(self, ticker):
+    h = self.holdings.get(ticker)
+    if h is None:
+      if self.default is KeyError:
+        raise KeyError(ticker)
+      return self.default
+    return getattr(h, self.field)
+
+
+  def get(self, ticker, default=None):
+    h = self.holdings.get(ticker)
+    return default if h is None else getattr(h, self.field)
+
+
+  def __contains__(self, ticker):
+    return ticker in self.holdings
+
+
+  def __iter__(self):
+    return iter(self.holdings)
+
+
+  def __len__(self):
+    return len(self.holdings)
+
+
+  def keys(self):
+    return self.holdings.keys()
+
+
+  def values(self):
+    return [getattr(h, self.field) for h in self.holdings.values()]
+
+
+  def items(self):
+    return [(t, getattr(h, self.field)) for t, h in self.holdings.items()]
+
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
+
+
+
+
+
+
+# append-only log of a portfolio's fills, see journal
+# ticker is an index into journal.tickers and side is 1 for a buy and -1 for a sell, as in backtest.fills
+JOURNAL = [('date', np.int64), ('ticker', np.int32), ('side', np.int8), ('shares', np.int64),
+           ('price', np.float64), ('commission', np.float64)]
+
+
+# trade journal
+class journal:
+  'Every fill of a portfolio in a structured array that doubles when full'
+
+  def __init__(self, capacity=64):
+    self.records = np.zeros(capacity, dtype=JOURNAL)
+    self.count = 0
+    self.tickers = []      # ticker names, by the index stored in the records
+    self.__index = dict()  # ticker -> index
+
+
+  def __len__(self):
+    return self.count
+
+
+  # pickled state: only the records written so far
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['records'] = self.records[:self.count].copy()
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    records = np.zeros(max(64, 2*self.count), dtype=JOURNAL)
+    records[:self.count] = state['records']
+    self.records = records
+
+
+  # log a fill on day
+  def append(self, day, ticker, side, shares, price, commission):
+    i = self.__index.get(ticker)
+    if i is None:
+      i = self.__index[ticker] = len(self.tickers)
+      self.tickers.append(ticker)
+    if self.count == len(self.records):
+      self.records = np.concatenate([self.records, np.zeros_like(self.records)])
+    self.records[self.count] = (day.toordinal(), i, side, shares, price, commission)
+    self.count += 1
+
+
+  # the fills as a structured array (a view, valid until the next append), dates as ordinals
+  def fills(self):
+    return self.records[:self.count]
+
+
+  # the fills as (date, ticker, side, shares, price, commission) tuples
+  def rows(self):
+    f = self.fills()
+    return zip([date.fromordinal(d) for d in f['date'].tolist()], [self.tickers[i] for i in f['ticker'].tolist()],
+               f['side'].tolist(), f['shares'].tolist(), f['price'].tolist(), f['commission'].tolist())
+
+
+  # write the fills to a csv file, or to a numpy .npy file (with the tickers as strings) if the name ends in .npy
+  def save(self, filename):
+    f = self.fills()
+    days = (f['date'] - EPOCH_ORDINAL).astype('datetime64[D]')
+    tickers = np.array(self.tickers or [''])[f['ticker']]
+    if filename.endswith('.npy'):
+      out = np.zeros(self.count, dtype=[('date', 'datetime64[D]'), ('ticker', tickers.dtype)] + JOURNAL[2:])
+      out['date'] = days
+      out['ticker'] = tickers
+      for name, dtype in JOURNAL[2:]:
+        out[name] = f[name]
+      np.save(filename, out)
+      return
+    lines = ['Date,Ticker,Side,Shares,Price,Commission']
+    lines += ['%s,%s,%s,%d,%r,%r' % row for row in zip(days.astype(str).tolist(), tickers.tolist(),
+              np.where(f['side'] > 0, 'BUY', 'SELL').tolist(), f['shares'].tolist(), f['price'].tolist(), f['commission'].tolist())]
+    out = open(filename, 'w')
+    out.write('\n'.join(lines) + '\n')
+    out.close()
+
+
+
+
+
+
+
+
+# resting orders of one side of a portfolio
+class orderbook:
+  'Buy or sell orders indexed by ticker and trigger price, with an expiry heap, so a day only touches orders it can fill'
+
+  # orders are order records, as made by portfolio.buy and portfolio.sell
+  def __init__(self, buy=True):
+    self.buy = buy
+    self.orders = OrderedDict() # sequence number -> order, in the order they were placed
+    self.tickers = dict()       # ticker -> [stock, set of sequence numbers, limit index, stop index, market sequence numbers]
+    self.expiries = []          # heap of (exp, sequence number)
+    self.reserved = 0.0         # buy side: cash set aside at the limit or stop price of the resting orders
+    self.seq = 0
+
+
+  def __len__(self):
+    return len(self.orders)
+
+
+  # iterate over the orders in the order they were placed
+  def __iter__(self):
+    return iter(self.orders.values())
+
+
+  # cash a buy order sets aside until it fills, market orders are priced by the portfolio at each close
+  def __reserve(self, o):
+    if o.stop:
+      return o.stop*o.shares
+    elif o.limit:
+      return o.limit*o.shares
+    return 0.0
+
+
+  # add an order
+  # the limit and stop indexes are sorted lists of (price, sequence number)
+  def append(self, o):
+    seq = self.seq
+    self.seq += 1
+    self.orders[seq] = o
+    entry = self.tickers.setdefault(o.stock.ticker, [o.stock, set(), [], [], []])
+    entry[1].add(seq)
+    if o.limit:
+      bisect.insort(entry[2], (o.limit, seq))
+    if o.stop:
+      bisect.insort(entry[3], (o.stop, seq))
+    if not o.limit and not o.stop:
+      entry[4].append(seq)
+    if o.exp:
+      heapq.heappush(self.expiries, (o.exp, seq))
+    if self.buy:
+      self.reserved += self.__reserve(o)
+
+
+  # remove an order by sequence number
+  def remove(self, seq):
+    o = self.orders.pop(seq)
+    ticker = o.stock.ticker
+    entry = self.tickers[ticker]
+    entry[1].remove(seq)
+    if o.limit:
+      del entry[2][bisect.bisect_left(entry[2], (o.limit, seq))]
+    if o.stop:
+      del entry[3][bisect.bisect_left(entry[3], (o.stop, seq))]
+    if not o.limit and not o.stop:
+      entry[4].remove(seq)
+    if not entry[1]:
+      del self.tickers[ticker]
+    if self.buy:
+      self.reserved -= self.__reserve(o)
+    return o
+
+
+  # drop the orders whose expiration date is on or before day
+  def expire(self, day):
+    while self.expiries and self.expiries[0][0] <= day:
+      seq = heapq.heappop(self.expiries)[1]
+      if seq in self.orders:
+        self.remove(seq)
+
+
+  # orders of a ticker, in the order they were placed
+  def pending(self, ticker):
+    if ticker not in self.tickers:
+      return []
+    return [self.orders[seq] for seq in sorted(self.tickers[ticker][1])]
+
+
+  # sequence numbers of the orders for a ticker that a day with this low and high can fill
+  # buy limits at or above the low, buy stops at or below the high, sell limits at or below the high,
+  # sell stops at or above the low, and every market order
+  def triggered(self, ticker, low, high):
+    entry = self.tickers[ticker]
+    limits, stops = entry[2], entry[3]
+    if self.buy:
+      seqs = [seq for price, seq in limits[bisect.bisect_left(limits, (low,)):]]
+      seqs += [seq for price, seq in stops[:bisect.bisect_right(stops, (high, float('inf')))]]
     else:
-      next_day = day + timedelta(days=1)
-      error = True
-      while error:
-        try:
-          val = self.__binsearch(self.data, next_day)
-        except StockError:
-          next_day = next_day + timedelta(days=1)
-        else:
-          error = False
-        if error and next_day > self.latest_date():
-          raise StockError('Error: No data for ' + self.ticker + ' after ' + str(day) + '.')
-      return next_day
+      seqs = [seq for price, seq in limits[:bisect.bisect_right(limits, (high, float('inf')))]]
+      seqs += [seq for price, seq in stops[bisect.bisect_left(stops, (low,)):]]
+    return seqs + entry[4]
+
 
 
 
@@ -361,6 +1313,12 @@ class stock:
 
 
 
+# portfolio history series, see portfolio.series
+HISTORY = [('date', np.int64), ('equity', np.float64), ('cash', np.float64), ('exposure', np.float64), ('traded', np.float64)]
+
+
+
+
 
 
 
@@ -370,7 +1328,9 @@ class portfolio:
   'Contains portfolio information, including money, stocks bought, and other stock trading metadata'
   
   # initialize portfolio with money and commission rate
-  def __init__(self, money=0, commission=10, date=date(2000, 1, 1)):
+  # calendar is the tradingcalendar the portfolio steps through, default_calendar() unless given
+  # capacity is the number of steps the history arrays are first allocated for, they grow as needed
+  def __init__(self, money=0, commission=10, date=date(2000, 1, 1), calendar=False, capacity=256):
     self.money = money # liquid funds
     self.tmoney = money # funds available for trading
     self.value = money # money + shares times current prices
@@ -379,21 +1339,111 @@ class portfolio:
     # positions contains a list of stock objects currently held by portfolio
     self.positions = [] 
 
-    # these dictionaries are all indexed by stock tickers, specifically those found in positions
-    self.shares = defaultdict(lambda: 0)        # how many shares of a stock this portfolio contains
-    self.buyprices = dict()                     # prices at which each stock was bought
-    self.maxprices = dict()                     # maximum prices seen since shares were purchased, including daily highs
-    self.minprices = dict()                     # minimum prices seen since shares were purchased, including daily lows
-    self.curprices = dict()                     # current (closing) prices for each stock
+    # holding records of the positions by ticker, in the order they were opened
+    self.holdings = OrderedDict()
+    self.__views()
+    self.flows = defaultdict(lambda: 0.0)       # cash paid for (negative) and received from (positive) each stock, for P&L
+
+    # every fill, see journal
+    self.journal = journal()
      
     # current date for this portfolio
     self.date = date
-    self.timer = stock('AAPL') # reference stock for next_day
-    self.timer.set_date(date)
+    self.calendar = calendar or default_calendar() # trading sessions for step
+    self.__default_calendar = not calendar # checkpoints store the default calendar by reference, see __getstate__
+    self.calendar.index(date)
 
     # buy and sell orders are executed at each tick of date
-    self.buy_orders = []
-    self.sell_orders = []
+    self.buy_orders = orderbook(True)
+    self.sell_orders = orderbook(False)
+
+    # [open, high, low, close] by ticker for the current date, fetched once per day and possibly shared, see step
+    self.__bars = dict()
+
+    # history of the portfolio after every step, starting with its initial state, see series
+    self.history = dict((name, np.zeros(capacity + 1, dtype=dtype)) for name, dtype in HISTORY)
+    self.steps = 0
+    self.traded = 0.0 # value of the shares bought and sold in the current step
+    self.__record()
+
+
+  # read-only dictionaries over the holdings, all indexed by ticker
+  def __views(self):
+    self.shares = fieldview(self.holdings, 'shares', 0) # how many shares of a stock this portfolio contains
+    self.buyprices = fieldview(self.holdings, 'buyprice') # prices at which each stock was bought
+    self.maxprices = fieldview(self.holdings, 'maxprice') # maximum prices seen since shares were purchased, including daily highs
+    self.minprices = fieldview(self.holdings, 'minprice') # minimum prices seen since shares were purchased, including daily lows
+    self.curprices = fieldview(self.holdings, 'curprice') # current (closing) prices for each stock
+
+
+  # pickled state: stocks are stored as (ticker, columnar, start, end) references and reloaded through the cache,
+  # the calendar as its session ordinals unless it is the default one, and the history arrays only as far as recorded
+  # stand-ins for stocks, like the quotes of a feed, are pickled whole (see feed.attach to reconnect them)
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    ref = lambda s: (s.ticker, s.columnar, s.start, s.end) if isinstance(s, stock) else s
+    del state['positions']
+    state['holdings'] = [(ref(h.stock), h.shares, h.buyprice, h.maxprice, h.minprice, h.curprice) for h in self.holdings.values()]
+    for view in ['shares', 'buyprices', 'maxprices', 'minprices', 'curprices']:
+      del state[view]
+    state['flows'] = dict(self.flows)
+    state['calendar'] = None if self.__default_calendar else np.array(self.calendar.days)
+    state['history'] = dict((name, a[:self.steps].copy()) for name, a in self.history.items())
+    state['_portfolio__bars'] = dict()
+    for book in ['buy_orders', 'sell_orders']:
+      b = getattr(self, book)
+      state[book] = {'orders': [(ref(o.stock), o.shares, o.limit, o.stop, o.exp) for o in b], 'reserved': b.reserved, 'seq': b.seq}
+    return state
+
+
+  # restore pickled state, reloading the stocks through the cache (one stock object per ticker)
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    stocks = dict()
+    def load(ref):
+      if not isinstance(ref, tuple):
+        return ref
+      if ref not in stocks:
+        stocks[ref] = cache.get(ref[0], ref[1], ref[2], ref[3])
+      return stocks[ref]
+    self.holdings = OrderedDict()
+    for ref, shares, buyprice, maxprice, minprice, curprice in state['holdings']:
+      s = load(ref)
+      h = self.holdings[s.ticker] = holding(s, shares, buyprice)
+      h.maxprice, h.minprice, h.curprice = maxprice, minprice, curprice
+    self.positions = [h.stock for h in self.holdings.values()]
+    self.__views()
+    self.flows = defaultdict(lambda: 0.0, state['flows'])
+    self.__default_calendar = state['calendar'] is None
+    self.calendar = default_calendar() if self.__default_calendar else tradingcalendar(state['calendar'])
+    capacity = max(len(a) for a in state['history'].values())*2
+    self.history = dict()
+    for name, a in state['history'].items():
+      self.history[name] = np.zeros(capacity, dtype=a.dtype)
+      self.history[name][:len(a)] = a
+    for book in ['buy_orders', 'sell_orders']:
+      saved = state[book]
+      b = orderbook(book == 'buy_orders')
+      for o in saved['orders']:
+        b.append(order(load(o[0]), *o[1:]))
+      b.reserved = saved['reserved'] # the running total, which a fresh sum could differ from in the last bits
+      b.seq = saved['seq']
+      setattr(self, book, b)
+
+
+  # write the portfolio's state to a file, small enough to do every few steps (see resume)
+  # the file is written under a temporary name and renamed, so a crash never leaves a partial checkpoint
+  def checkpoint(self, filename):
+    tmpfile = temp_file(filename)
+    f = open(tmpfile, 'wb')
+    pickle.dump(self, f, -1)
+    f.close()
+    os.rename(tmpfile, filename)
+
+
+  # independent copy of the portfolio in its current state, e.g. to run several scenarios from one warmed-up start
+  def fork(self):
+    return pickle.loads(pickle.dumps(self, -1))
 
 
   # print portfolio info
@@ -421,7 +1471,7 @@ class portfolio:
       print '|  Ticker  |  Shares  |  Limit$  |  Stop$   |   Exp    |'
       for p in self.buy_orders:
         print '--------------------------------------------------------'
-        print '|' + p[0].ticker.center(10) + '|' + str(p[1]).center(10) + '|' + ('%0.2f' % p[2] if p[2] else 'N/A').center(10) + '|' + ('%0.2f' % p[3] if p[3] else 'N/A').center(10) + '|' + (str(p[4]) if p[4] else 'GTC').center(10) + '|'
+        print '|' + p.stock.ticker.center(10) + '|' + str(p.shares).center(10) + '|' + ('%0.2f' % p.limit if p.limit else 'N/A').center(10) + '|' + ('%0.2f' % p.stop if p.stop else 'N/A').center(10) + '|' + (str(p.exp) if p.exp else 'GTC').center(10) + '|'
     if len(self.sell_orders) > 0:
       print '--------------------------------------------------------'
       print 'Sell Orders:'
@@ -429,7 +1479,7 @@ class portfolio:
       print '|  Ticker  |  Shares  |  Limit$  |  Stop$   |   Exp    |'
       for p in self.sell_orders:
         print '--------------------------------------------------------'
-        print '|' + p[0].ticker.center(10) + '|' + str(p[1]).center(10) + '|' + ('%0.2f' % p[2] if p[2] else 'N/A').center(10) + '|' + ('%0.2f' % p[3] if p[3] else 'N/A').center(10) + '|' + (str(p[4]) if p[4] else 'GTC').center(10) + '|'
+        print '|' + p.stock.ticker.center(10) + '|' + str(p.shares).center(10) + '|' + ('%0.2f' % p.limit if p.limit else 'N/A').center(10) + '|' + ('%0.2f' % p.stop if p.stop else 'N/A').center(10) + '|' + (str(p.exp) if p.exp else 'GTC').center(10) + '|'
     return '--------------------------------------------------------\n'
 
 
@@ -452,9 +1502,8 @@ class portfolio:
     elif limit: 
       self.tmoney = self.tmoney - limit*shares
     else:
-      self.tmoney = self.tmoney - stock.close(self.date)*shares
-    order = [stock, shares, limit, stop, exp]
-    self.buy_orders.append(order)
+      self.tmoney = self.tmoney - self.__bar(stock)[3]*shares
+    self.buy_orders.append(order(stock, shares, limit, stop, exp))
 
 
   # puts in a sell order
@@ -477,131 +1526,167 @@ class portfolio:
         raise StockError('Error: This portfolio does not own any shares of ' + stock.ticker + '.')
       else:
         shares = self.shares[stock.ticker]
-    for so in self.sell_orders:
-      if so[0] == stock and so[1] + shares > self.shares[stock.ticker]:
+    for so in self.sell_orders.pending(stock.ticker):
+      if so.shares + shares > self.shares[stock.ticker]:
         raise StockError('Error: Multiple sell orders of stock ' + stock.ticker + ' exceed the shares owned.')
-    order = [stock, shares, limit, stop, exp]
-    self.sell_orders.append(order)
+    self.sell_orders.append(order(stock, shares, limit, stop, exp))
 
 
   # check existing orders and execute as needed
+  # only orders that expired or whose limit/stop lies within the day's range are looked at, see orderbook.triggered
   def __exec_orders(self):
+    self.buy_orders.expire(self.date)
+    self.sell_orders.expire(self.date)
+
+    # one bar per ticker with resting orders
+    bars = dict()
+    for book in [self.buy_orders, self.sell_orders]:
+      for ticker, entry in book.tickers.items():
+        if ticker not in bars:
+          bars[ticker] = self.__bar(entry[0])
 
     # buy orders
-    # order formatting: [stock, shares, limit, stop, exp]
-    new_buy_orders = []
-    for bo in self.buy_orders:
-      if bo[4] and bo[4] <= self.date:
-        continue
-      # load stock from position if it's in there already
-      s = bo[0]
-      popen = s.open(self.date)
-      if bo[2]: # limit order
-        if popen < bo[2]:
-          self.__ibuy(s, bo[1], popen)
-          continue
-        elif s.low(self.date) <= bo[2]:
-          self.__ibuy(s, bo[1], bo[2])
-          continue
-      if bo[3]: # stop order
-        if popen > bo[3]:
-          self.__ibuy(s, bo[1], popen)
-          continue
-        elif s.high(self.date) >= bo[3]:
-          self.__ibuy(s, bo[1], bo[3])
-          continue
-      if not bo[2] and not bo[3]: # market order
-        self.__ibuy(s, bo[1], popen)
-        continue
-      new_buy_orders.append(bo)
-    self.buy_orders = new_buy_orders
+    seqs = []
+    for ticker in self.buy_orders.tickers.keys():
+      seqs += self.buy_orders.triggered(ticker, bars[ticker][2], bars[ticker][1])
+    for seq in sorted(set(seqs)): # orders with both a limit and a stop can show up twice
+      bo = self.buy_orders.orders[seq]
+      [popen, phigh, plow] = bars[bo.stock.ticker][:3]
+      price = False
+      if bo.limit: # limit order
+        if popen < bo.limit:
+          price = popen
+        elif plow <= bo.limit:
+          price = bo.limit
+      if bo.stop and not price: # stop order
+        if popen > bo.stop:
+          price = popen
+        elif phigh >= bo.stop:
+          price = bo.stop
+      if not bo.limit and not bo.stop: # market order
+        price = popen
+      if price:
+        self.buy_orders.remove(seq)
+        self.__ibuy(bo.stock, bo.shares, price)
 
     # sell orders
-    # order formatting: [stock, shares, limit, stop, exp]
-    new_sell_orders = []
-    for so in self.sell_orders:
-      if so[4] and so[4] <= self.date:
-        continue
-      s = False
-      for pos in self.positions:
-        if pos.ticker == so[0].ticker:
-          s = pos
-      if not s:
+    seqs = []
+    for ticker in self.sell_orders.tickers.keys():
+      seqs += self.sell_orders.triggered(ticker, bars[ticker][2], bars[ticker][1])
+    for seq in sorted(set(seqs)): # orders with both a limit and a stop can show up twice
+      so = self.sell_orders.orders[seq]
+      if so.stock.ticker not in self.holdings:
         raise StockError('Error: Tried to sell shares of unowned stock!')
-      popen = s.open(self.date)
-      if so[2]: # limit order
-        if popen > so[2]:
-          self.__isell(s, so[1], popen)
-          continue
-        elif s.high(self.date) >= so[2]:
-          self.__isell(s, so[1], so[2])
-          continue
-      if so[3]: # stop order
-        if popen < so[3]:
-          self.__isell(s, so[1], popen)
-          continue
-        elif s.low(self.date) <= so[3]:
-          self.__isell(s, so[1], so[3])
-          continue
-      if not so[2] and not so[3]: # market order
-        self.__isell(s, so[1], popen)
-        continue
-      new_sell_orders.append(so)
-    self.sell_orders = new_sell_orders
-
-
-  # buy a stock
+      [popen, phigh, plow] = bars[so.stock.ticker][:3]
+      price = False
+      if so.limit: # limit order
+        if popen > so.limit:
+          price = popen
+        elif phigh >= so.limit:
+          price = so.limit
+      if so.stop and not price: # stop order
+        if popen < so.stop:
+          price = popen
+        elif plow <= so.stop:
+          price = so.stop
+      if not so.limit and not so.stop: # market order
+        price = popen
+      if price:
+        self.sell_orders.remove(seq)
+        self.__isell(so.stock, so.shares, price)
+
+
+  # buy a stock, logging the fill
   def __ibuy(self, stock, shares, price):
-    if not stock in self.positions:
+    h = self.holdings.get(stock.ticker)
+    if h is None: # a new position, whichever stock object the order was placed with
+      self.holdings[stock.ticker] = holding(stock, shares, price)
       self.positions.append(stock)
-      self.shares[stock.ticker] = shares
-      self.buyprices[stock.ticker] = price
-      self.maxprices[stock.ticker] = price
-      self.minprices[stock.ticker] = price
     else:
-      existing_shares = self.shares[stock.ticker]
-      self.shares[stock.ticker] = existing_shares+shares
-      self.buyprices[stock.ticker] = (self.buyprices[stock.ticker]*existing_shares+price*shares)/(existing_shares+shares)
+      h.buyprice = (h.buyprice*h.shares+price*shares)/(h.shares+shares)
+      h.shares += shares
     self.money -= price*shares-self.commission
-        
+    self.flows[stock.ticker] -= price*shares-self.commission
+    self.traded += price*shares
+    self.journal.append(self.date, stock.ticker, 1, shares, price, self.commission)
 
-  # sell a stock
+
+  # sell a stock, logging the fill
   def __isell(self, stock, shares, price):
-    if shares == self.shares[stock.ticker]:
-      self.positions.remove(stock)
-      del self.shares[stock.ticker] 
-      del self.buyprices[stock.ticker] 
-      del self.maxprices[stock.ticker] 
-      del self.minprices[stock.ticker] 
-      del self.curprices[stock.ticker] 
+    h = self.holdings[stock.ticker]
+    if shares == h.shares:
+      del self.holdings[stock.ticker]
+      self.positions.remove(h.stock)
     else:
-      self.shares[stock.ticker] -= shares
+      h.shares -= shares
     self.money += price*shares-self.commission
-      
+    self.flows[stock.ticker] += price*shares-self.commission
+    self.traded += price*shares
+    self.journal.append(self.date, stock.ticker, -1, shares, price, self.commission)
+
+
+  # bar of a stock on the current date
+  def __bar(self, stock):
+    bar = self.__bars.get(stock.ticker)
+    if bar is None:
+      bar = self.__bars[stock.ticker] = stock.bar(self.date)
+    return bar
+
+
+  # append the current state to the history, doubling the arrays when they are full
+  def __record(self):
+    if self.steps == len(self.history['date']):
+      for name in self.history:
+        self.history[name] = np.concatenate([self.history[name], np.zeros_like(self.history[name])])
+    i = self.steps
+    self.history['date'][i] = self.date.toordinal()
+    self.history['equity'][i] = self.value
+    self.history['cash'][i] = self.money
+    self.history['exposure'][i] = self.value - self.money
+    self.history['traded'][i] = self.traded
+    self.steps += 1
+    self.traded = 0.0
+
+
+  # recorded history of one of date (as ordinals), equity, cash, exposure (value of the positions) or traded
+  # (value of the shares bought and sold), one entry for the initial state and one after every step
+  def series(self, name):
+    return self.history[name][:self.steps]
+
 
   # increments the date, executes orders, and updates current value
-  def step(self):
+  # bars is a dictionary for the new date's bars shared by portfolios stepping in lockstep (see simulator.py),
+  # so each ticker is looked up once per day however many portfolios trade it
+  # day steps to that date instead of the next calendar session, for bars streamed from a feed (see feed.py)
+  def step(self, bars=False, day=False):
     updated = False
-    self.timer.step_date()
-    self.date = self.timer.date
+    if day and day <= self.date:
+      raise StockError('Error: Cannot step a portfolio back to ' + str(day) + '.')
+    self.date = day or self.calendar.next(self.date)
+    self.__bars = dict() if bars is False else bars
     self.__exec_orders()
     self.value = self.money
-    self.tmoney = self.money
-    for bo in self.buy_orders:
-      if bo[3]:
-        self.tmoney = self.tmoney - bo[3]*bo[1]
-      elif bo[2]:
-        self.tmoney = self.tmoney - bo[2]*bo[1]
-      else:
-        self.tmoney = self.tmoney - bo[0].close(self.date)*bo[1]
-    for s in self.positions:
-      #s.step_date()
-      close = s.close(self.date)
-      high = s.high(self.date)
-      low = s.low(self.date)
-      self.curprices[s.ticker] = close
-      if low < self.minprices[s.ticker]:
-        self.minprices[s.ticker] = low
-      if high > self.maxprices[s.ticker]:
-        self.maxprices[s.ticker] = high
-      self.value += close*self.shares[s.ticker]
+    self.tmoney = self.money - self.buy_orders.reserved
+    for entry in self.buy_orders.tickers.values():
+      for seq in entry[4]: # market orders left over
+        self.tmoney = self.tmoney - self.__bar(entry[0])[3]*self.buy_orders.orders[seq].shares
+    for h in self.holdings.values():
+      [popen, high, low, close] = self.__bar(h.stock)
+      h.curprice = close
+      if low < h.minprice:
+        h.minprice = low
+      if high > h.maxprice:
+        h.maxprice = high
+      self.value += close*h.shares
+    self.__record()
+
+
+
+
+
+
+
+
+# load a portfolio written by portfolio.checkpoint, ready to step on from where it was
+def resume(filename):
+  return pickle.load(open(filename, 'rb'))
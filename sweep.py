@@ -0,0 +1,102 @@
+#! /opt/local/bin/python
+# sweep.py contains the sweep object, which runs a strategy over a grid of parameters on a process pool
+
+import itertools
+import multiprocessing
+import numpy as np
+from datetime import date, timedelta
+from collections import OrderedDict
+from stock import portfolio, cache, default_calendar
+
+
+# the sweep being run, set before the pool forks so workers inherit it instead of receiving it pickled
+_current = None
+
+
+# run one set of parameters in a worker
+def _run(task):
+  i, params = task
+  return i, _current.run_one(params)
+
+
+
+
+
+
+
+
+# parameter sweep over a process pool
+class sweep:
+  'Runs a strategy over every combination of a parameter grid, one portfolio per combination'
+
+  # strategy is called as strategy(portfolio, params) before every step, and places orders on the portfolio
+  # grid maps parameter names to lists of values; money, commission and start in a combination override the defaults
+  # start moves to the first session of default_calendar() on or after it, so the default Saturday works
+  # tickers are loaded into the stock cache before the pool forks, so workers share them copy-on-write
+  # (binary datfiles are shared through the page cache in any case)
+  def __init__(self, strategy, grid, days, money=10000, commission=10, start=date(2000, 1, 1), tickers=[], processes=None):
+    self.strategy = strategy
+    self.days = days
+    self.defaults = {'money': money, 'commission': commission, 'start': start}
+    self.tickers = tickers
+    self.processes = processes or multiprocessing.cpu_count()
+    names = sorted(grid)
+    self.params = [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+    self.results = []                  # one dictionary per combination, in grid order, filled in by run()
+    self.values = np.zeros(0)          # final portfolio value per combination
+    self.equity = np.zeros((0, days))  # portfolio value after every step, combinations x days
+    self.traded = np.zeros((0, days))  # value bought and sold in every step, combinations x days
+
+
+  # run one combination and return its result row
+  # trades are (date, ticker, change in shares) for every day a holding changed, netted from the portfolio's journal
+  def run_one(self, params):
+    settings = dict(self.defaults)
+    settings.update((k, v) for k, v in params.items() if k in settings)
+    start = default_calendar().next(settings['start'] - timedelta(days=1))
+    p = portfolio(settings['money'], settings['commission'], start, capacity=self.days)
+    equity = np.zeros(self.days)
+    for i in range(self.days):
+      self.strategy(p, params)
+      p.step()
+      equity[i] = p.value
+    changes = OrderedDict()
+    for day, ticker, side, shares, price, commission in p.journal.rows():
+      changes[(day, ticker)] = changes.get((day, ticker), 0) + side*shares
+    trades = [(day, ticker, change) for (day, ticker), change in changes.items() if change]
+    row = dict(params)
+    row.update({'value': p.value, 'money': p.money, 'end': p.date, 'shares': dict(p.shares), 'trades': trades, 'equity': equity,
+                'traded': p.series('traded')[1:].copy()})
+    return row
+
+
+  # run every combination, returns the list of result rows
+  def run(self):
+    global _current
+    for ticker in self.tickers:
+      cache.get(ticker)
+    default_calendar().next(self.defaults['start']) # builds the session table before the pool forks
+    self.results = [None]*len(self.params)
+    if self.processes == 1:
+      for i, params in enumerate(self.params):
+        self.results[i] = self.run_one(params)
+    else:
+      _current = self
+      pool = multiprocessing.Pool(self.processes)
+      chunksize = max(1, len(self.params) // (self.processes*4))
+      try:
+        for i, row in pool.imap_unordered(_run, enumerate(self.params), chunksize):
+          self.results[i] = row
+      finally:
+        pool.close()
+        pool.join()
+        _current = None
+    self.values = np.array([row['value'] for row in self.results])
+    self.equity = np.array([row['equity'] for row in self.results]).reshape(len(self.results), self.days)
+    self.traded = np.array([row['traded'] for row in self.results]).reshape(len(self.results), self.days)
+    return self.results
+
+
+  # results as one table: a list of tuples with the given columns, e.g. table(['commission', 'value'])
+  def table(self, columns):
+    return [tuple(row[c] for c in columns) for row in self.results]